@@ -1,119 +1,186 @@
 import streamlit as st
+import contextlib
 import io
-import math
-import zipfile
+import os
+import tempfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from PIL import Image
-import numpy as np
 
-def calculate_grid_size(num_images, cols_per_row=None):
-    """Calculate grid dimensions for given number of images"""
-    if num_images == 0:
-        return 0, 0
-    elif num_images == 1:
-        return 1, 1
+from collage import (
+    CollageState, TileCache, calculate_grid_size, count_missing_tiles, create_collage, resize_single_image,
+    stream_collage, validate_image
+)
+from collage import metrics
+from collage.ingest import ingest_upload, make_thumbnail, open_record
+from collage.encode import OUTPUT_FORMATS, BackgroundEncoder, encode_image, encode_preview
+from collage.export import ExportResult, choose_export, export_collage, link_export
+from collage.jobs import DONE, FAILED, FINISHED, JobQueue
+from collage.layout import compute_layout, image_sizes
+from collage.memory import SESSION_CAP_BYTES, decode_pool_stats, pool_decode_buffers, record_bytes, session_usage
+from collage.sources import hash_bytes
+from collage.store import UploadStore
+
+# Preset scale factors for the resize tab
+SCALE_OPTIONS = {
+    "0.25x (Quarter size)": 0.25,
+    "0.5x (Half size)": 0.5,
+    "1x (Original size)": 1.0,
+    "2x (Double size)": 2.0,
+    "4x (Quadruple size)": 4.0
+}
+
+# Collage layouts; see collage.layout for how each places its tiles
+LAYOUT_OPTIONS = {
+    "Grid (cells fit the largest image)": 'grid',
+    "Fixed cells, fit": 'fit',
+    "Fixed cells, fill": 'fill',
+    "Fixed cells, crop": 'crop',
+    "Justified rows": 'justified',
+}
+
+# Resampling tiers; see collage.resample for the filters and README for their cost
+QUALITY_OPTIONS = {
+    "Balanced (default)": 'balanced',
+    "Best (LANCZOS)": 'best',
+    "Fast (preview)": 'fast',
+}
+
+@st.cache_resource
+def get_tile_cache():
+    """Process-wide tile cache shared by every rerun and session"""
+    return TileCache()
+
+@st.cache_resource
+def get_encoder():
+    """Process-wide background encoder, memoized by collage version and options"""
+    return BackgroundEncoder()
+
+@st.cache_resource
+def setup_decode_pool():
+    """Have this process reuse freed pixel blocks across decodes; runs once"""
+    pool_decode_buffers()
+
+@st.cache_resource
+def get_upload_store():
+    """Process-wide store of ingested uploads, so identical files are shared across sessions"""
+    # Evicted uploads take their cached tiles with them
+    return UploadStore(tile_cache=get_tile_cache())
+
+def stored_outputs():
+    """Encoded results this session keeps, for memory accounting"""
+    blobs = []
+    for key in ('collage', 'resized_single'):
+        stored = st.session_state.get(key)
+        if stored:
+            # Exported collages live on disk; only their preview is held
+            blobs.extend([stored.get('png'), stored['preview']])
+    if 'batch_zip' in st.session_state:
+        blobs.append(st.session_state.batch_zip)
+    return blobs
+
+@st.cache_resource
+def get_job_queue():
+    """Process-wide background job queue; its pool size caps concurrent renders per host"""
+    return JobQueue()
+
+def replace_export_dir(export_dir=None):
+    """Make export_dir this session's export directory, deleting the previous one and the collage in it"""
+    previous = st.session_state.pop('export_dir', None)
+    if previous is not None:
+        previous.cleanup()
+    if export_dir is not None:
+        st.session_state.export_dir = export_dir
+
+def encode_options():
+    """(format, quality, compress_level, lossless) picked in the download settings, or their defaults"""
+    output_format = st.session_state.get('output_format', next(iter(OUTPUT_FORMATS)))
+    compress_level, quality, lossless = 6, 90, False
+    if output_format == 'PNG':
+        compress_level = st.session_state.get('png_compress_level', 6)
     else:
-        if cols_per_row:
-            # Use specified columns per row
-            cols = cols_per_row
-            rows = math.ceil(num_images / cols)
-        else:
-            # Calculate square root and round up for rows (default behavior)
-            sqrt_num = math.sqrt(num_images)
-            rows = math.ceil(sqrt_num)
-            cols = math.ceil(num_images / rows)
-        return rows, cols
+        if output_format == 'WEBP':
+            lossless = st.session_state.get('webp_lossless', False)
+        if not lossless:
+            quality = st.session_state.get('encode_quality', 90)
+    return output_format, quality, compress_level, lossless
 
-def resize_image(image, scale_factor=0.45):
-    """Resize image by scale factor while maintaining aspect ratio"""
-    # Convert to RGB if necessary (for PNG with transparency)
-    if image.mode in ('RGBA', 'LA', 'P'):
-        # Create a white background
-        background = Image.new('RGB', image.size, (255, 255, 255))
-        if image.mode == 'P':
-            image = image.convert('RGBA')
-        background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-        image = background
-    elif image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    # Calculate new size based on scale factor
-    new_width = int(image.width * scale_factor)
-    new_height = int(image.height * scale_factor)
-    
-    # Resize image maintaining aspect ratio
-    resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-    
-    return resized_image
+def submit_encode():
+    """Start, or look up, the encode of the session's collage in the chosen download format"""
+    stored = st.session_state.collage
+    with st.session_state.get('last_run') or contextlib.nullcontext():
+        return get_encoder().submit(
+            st.session_state.collage_version,
+            lambda data=stored['png']: Image.open(io.BytesIO(data)),
+            *encode_options()
+        )
 
-def create_collage(images, scale_factor=0.45, cols_per_row=None):
-    """Create a grid collage from list of images without whitespace"""
-    if not images:
-        return None
-    
-    num_images = len(images)
-    rows, cols = calculate_grid_size(num_images, cols_per_row)
-    
-    # Resize all images
-    resized_images = []
-    for img in images:
-        resized_img = resize_image(img, scale_factor)
-        resized_images.append(resized_img)
-    
-    # Calculate collage dimensions based on actual image sizes
-    if resized_images:
-        # Get the maximum width and height from all resized images
-        max_width = max(img.width for img in resized_images)
-        max_height = max(img.height for img in resized_images)
-        
-        # Create the collage without any padding
-        collage_width = cols * max_width
-        collage_height = rows * max_height
-        collage = Image.new('RGB', (collage_width, collage_height), (255, 255, 255))
-        
-        for i, img in enumerate(resized_images):
-            row = i // cols
-            col = i % cols
-            x = col * max_width
-            y = row * max_height
-            collage.paste(img, (x, y))
-        
-        return collage
-    
-    return None
+def store_collage(stored, version):
+    """Keep a new collage, dropping the encodes of the one it replaces and starting its download encode"""
+    previous = st.session_state.get('collage_version')
+    if previous is not None and previous != version:
+        get_encoder().forget(previous)
+    st.session_state.collage = stored
+    st.session_state.collage_version = version
+    # Exports are downloaded as written; everything else is encoded while the page renders
+    if 'export' not in stored:
+        submit_encode()
+
+def store_collage_result(job):
+    # Tiles the worker resized warm this process's cache for later reorders, in any session
+    tile_cache = get_tile_cache()
+    for key, tile in job.result.pop('tiles', ()):
+        tile_cache.put(key, tile)
+    result = job.result
+    if 'export' in result:
+        # The job's file is deleted when the job is evicted, so the session links it into its own directory
+        export_dir = tempfile.TemporaryDirectory(prefix='collage-export-')
+        path = link_export(result['export']['path'], export_dir.name)
+        result = {**result, 'export': {**result['export'], 'path': path}}
+        replace_export_dir(export_dir)
+    else:
+        replace_export_dir()
+    # The worker's stage breakdown, when metrics were on
+    st.session_state.last_run = job.run
+    # Reusing the job id lets the encoder memo serve repeated requests
+    store_collage(result, job.job_id)
 
-def validate_image(uploaded_file):
-    """Validate if uploaded file is a valid image"""
-    try:
-        image = Image.open(uploaded_file)
-        # Verify it's a valid image by loading it
-        image.verify()
-        # Reset file pointer after verify
-        uploaded_file.seek(0)
-        return True, None
-    except Exception as e:
-        return False, str(e)
+def store_batch_result(job):
+    st.session_state.batch_zip = job.result['zip']
+    st.session_state.batch_errors = job.result['errors']
 
-def resize_single_image(image, scale_factor):
-    """Resize a single image by the specified scale factor"""
-    # Convert to RGB if necessary (for PNG with transparency)
-    if image.mode in ('RGBA', 'LA', 'P'):
-        # Create a white background
-        background = Image.new('RGB', image.size, (255, 255, 255))
-        if image.mode == 'P':
-            image = image.convert('RGBA')
-        background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
-        image = background
-    elif image.mode != 'RGB':
-        image = image.convert('RGB')
-    
-    # Calculate new size based on scale factor
-    new_width = int(image.width * scale_factor)
-    new_height = int(image.height * scale_factor)
-    
-    # Resize image maintaining aspect ratio
-    resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+@st.fragment(run_every=0.5)
+def wait_for_encode(future):
+    """Poll a background encode, rerunning the page once its download is ready"""
+    if future.done():
+        st.rerun()
+    st.caption("⏳ Encoding collage...")
+
+@st.fragment(run_every=0.5)
+def show_job_progress(job_key, on_done):
+    """Poll the job whose id is in session_state[job_key], handing its result to on_done"""
+    job = get_job_queue().get(st.session_state[job_key])
+    if job is None or job.status in FINISHED:
+        del st.session_state[job_key]
+        if job is not None and job.status == DONE:
+            on_done(job)
+        elif job is not None and job.status == FAILED:
+            st.session_state[f"{job_key}_error"] = job.error
+        st.rerun()
     
-    return resized_image
+    if job.total:
+        text = f"{job.status.capitalize()}: {job.done} / {job.total}"
+    else:
+        text = f"{job.status.capitalize()}: {job.done} done"
+    st.progress(job.fraction, text=text)
+    if st.button("✖️ Cancel", key=f"cancel_{job_key}"):
+        get_job_queue().cancel(job.job_id)
+
+def show_job_error(job_key):
+    """Report, once, a job that failed since the last rerun"""
+    error = st.session_state.pop(f"{job_key}_error", None)
+    if error:
+        st.error(f"❌ Background job failed: {error}")
 
 def main():
     st.set_page_config(
@@ -121,6 +188,7 @@ def main():
         page_icon="🖼️",
         layout="wide"
     )
+    setup_decode_pool()
     
     st.title("🖼️ Image Collage Generator & Resizer")
     st.markdown("Upload multiple images to create a beautiful grid collage, or resize a single image!")
@@ -147,20 +215,17 @@ def main():
             
             if is_valid:
                 try:
-                    original_image = Image.open(single_image_file)
+                    # Only the header is read here; pixels are decoded on demand, and not at all on a cache hit
+                    original_bytes = single_image_file.getvalue()
+                    original_image = Image.open(io.BytesIO(original_bytes))
+                    original_image.content_digest = hash_bytes(original_bytes)
                     
                     # Display original image info
                     st.success(f"✅ Image uploaded successfully!")
                     st.write(f"**Original dimensions:** {original_image.width} × {original_image.height} pixels")
                     
                     # Scale factor selection
-                    scale_options = {
-                        "0.25x (Quarter size)": 0.25,
-                        "0.5x (Half size)": 0.5,
-                        "1x (Original size)": 1.0,
-                        "2x (Double size)": 2.0,
-                        "4x (Quadruple size)": 4.0
-                    }
+                    scale_options = SCALE_OPTIONS
                     
                     selected_scale_label = st.selectbox(
                         "Select resize factor:",
@@ -169,6 +234,12 @@ def main():
                     )
                     
                     selected_scale = scale_options[selected_scale_label]
+                    single_quality = QUALITY_OPTIONS[st.selectbox(
+                        "Resampling quality:",
+                        options=list(QUALITY_OPTIONS.keys()),
+                        key="single_quality",
+                        help="Balanced matches Best to the eye and is much faster for large downscales"
+                    )]
                     
                     # Calculate and display new dimensions
                     new_width = int(original_image.width * selected_scale)
@@ -180,38 +251,35 @@ def main():
                     
                     with col1:
                         st.subheader("Original Image")
-                        # Create thumbnail for display if image is too large
-                        display_original = original_image.copy()
-                        if display_original.width > 400 or display_original.height > 400:
-                            display_original.thumbnail((400, 400), Image.Resampling.LANCZOS)
-                        st.image(display_original, caption=f"Original: {original_image.width}×{original_image.height}")
+                        # Reduced-scale decode for display if image is too large
+                        st.image(make_thumbnail(original_bytes, (400, 400)), caption=f"Original: {original_image.width}×{original_image.height}")
                     
                     with col2:
                         st.subheader("Resized Image")
                         if st.button("🔄 Apply Resize", type="primary"):
                             with st.spinner("Resizing image..."):
                                 try:
-                                    resized_image = resize_single_image(original_image, selected_scale)
-                                    st.session_state.resized_single_image = resized_image
+                                    resized_image = resize_single_image(
+                                        original_image, selected_scale, cache=get_tile_cache(), quality=single_quality
+                                    )
+                                    # Keep encoded bytes, not the decoded image, in the session
+                                    st.session_state.resized_single = {
+                                        'png': encode_image(resized_image, 'PNG').data,
+                                        'preview': encode_preview(resized_image, (400, 400)),
+                                        'size': resized_image.size,
+                                    }
+                                    del resized_image
                                     st.success("✅ Image resized successfully!")
                                 except Exception as e:
                                     st.error(f"❌ Error resizing image: {str(e)}")
                         
                         # Display resized image if it exists
-                        if 'resized_single_image' in st.session_state:
-                            resized_img = st.session_state.resized_single_image
-                            # Create thumbnail for display if image is too large
-                            display_resized = resized_img.copy()
-                            if display_resized.width > 400 or display_resized.height > 400:
-                                display_resized.thumbnail((400, 400), Image.Resampling.LANCZOS)
-                            st.image(display_resized, caption=f"Resized: {resized_img.width}×{resized_img.height}")
+                        if 'resized_single' in st.session_state:
+                            resized = st.session_state.resized_single
+                            st.image(resized['preview'], caption=f"Resized: {resized['size'][0]}×{resized['size'][1]}")
                             
                             # Download button for resized image
                             try:
-                                img_buffer = io.BytesIO()
-                                resized_img.save(img_buffer, format='PNG')
-                                img_bytes = img_buffer.getvalue()
-                                
                                 # Create filename with scale factor
                                 original_name = single_image_file.name.rsplit('.', 1)[0]
                                 scale_suffix = selected_scale_label.split(' ')[0].replace('.', '_')
@@ -219,7 +287,7 @@ def main():
                                 
                                 st.download_button(
                                     label="💾 Download Resized Image",
-                                    data=img_bytes,
+                                    data=resized['png'],
                                     file_name=filename,
                                     mime="image/png",
                                     type="primary"
@@ -231,6 +299,64 @@ def main():
                     st.error(f"❌ Error processing image: {str(e)}")
             else:
                 st.error(f"❌ Invalid image file: {error_msg}")
+        
+        st.divider()
+        st.subheader("📦 Batch Resize")
+        st.markdown("Resize many images at once, or whole ZIP archives, into a single ZIP download.")
+        
+        batch_files = st.file_uploader(
+            "Choose image files or ZIP archives",
+            type=['png', 'jpg', 'jpeg', 'zip'],
+            accept_multiple_files=True,
+            key="batch_uploader",
+            help="ZIP archives are read member by member without extracting them"
+        )
+        
+        if batch_files:
+            batch_cols = st.columns(3)
+            with batch_cols[0]:
+                batch_scale_label = st.selectbox(
+                    "Batch resize factor:",
+                    options=list(SCALE_OPTIONS.keys()),
+                    index=1,
+                    key="batch_scale"
+                )
+            with batch_cols[1]:
+                batch_format = st.selectbox("Output format", options=list(OUTPUT_FORMATS.keys()), key="batch_format")
+            with batch_cols[2]:
+                batch_quality = QUALITY_OPTIONS[st.selectbox(
+                    "Resampling quality", options=list(QUALITY_OPTIONS.keys()), key="batch_quality"
+                )]
+            
+            if st.button("📦 Resize All", type="primary"):
+                # Runs on a worker process; ZIP archives are expanded there
+                spec = {
+                    'files': [(f.name, f.getvalue()) for f in batch_files],
+                    'scale': SCALE_OPTIONS[batch_scale_label],
+                    'format': batch_format,
+                    'quality': batch_quality,
+                }
+                key = hash_bytes(repr((
+                    [f.file_id for f in batch_files], SCALE_OPTIONS[batch_scale_label], batch_format, batch_quality
+                )).encode())
+                st.session_state.batch_job = get_job_queue().submit('batch_resize', spec, key=key)
+            
+            show_job_error('batch_job')
+            if 'batch_job' in st.session_state:
+                show_job_progress('batch_job', store_batch_result)
+            
+            if 'batch_zip' in st.session_state:
+                if st.session_state.batch_errors:
+                    st.error("❌ Some files could not be resized:")
+                    for error in st.session_state.batch_errors:
+                        st.write(f"• {error}")
+                st.download_button(
+                    label="💾 Download Resized Images (ZIP)",
+                    data=st.session_state.batch_zip,
+                    file_name="resized_images.zip",
+                    mime="application/zip",
+                    type="primary"
+                )
     
     with tab1:
         # Settings section moved to main area
@@ -250,6 +376,11 @@ def main():
                 step=5,
                 help="Percentage to resize images while maintaining aspect ratio"
             ) / 100.0
+            resample_quality = QUALITY_OPTIONS[st.selectbox(
+                "Resampling quality",
+                options=list(QUALITY_OPTIONS.keys()),
+                help="Fast is for quick drafts; Balanced pre-shrinks large downscales before the final LANCZOS pass"
+            )]
         
         with settings_col2:
             # Grid layout settings
@@ -262,19 +393,55 @@ def main():
                 step=1,
                 help="Number of images to display per row in the collage"
             )
+            layout_mode = LAYOUT_OPTIONS[st.selectbox(
+                "Layout",
+                options=list(LAYOUT_OPTIONS.keys()),
+                help="Fixed cells and justified rows size the canvas by the median image, not the largest"
+            )]
+            cell_size, row_height = None, None
+            if layout_mode in ('fit', 'fill', 'crop'):
+                cell_cols = st.columns(2)
+                with cell_cols[0]:
+                    cell_width = st.number_input("Cell width (px)", min_value=0, value=0, step=10, help="0 uses the median resized width")
+                with cell_cols[1]:
+                    cell_height = st.number_input("Cell height (px)", min_value=0, value=0, step=10, help="0 uses the median resized height")
+                if cell_width and cell_height:
+                    cell_size = (int(cell_width), int(cell_height))
+            elif layout_mode == 'justified':
+                row_height = st.number_input("Row height (px)", min_value=0, value=0, step=10, help="0 uses the median resized height") or None
+            max_megapixels = st.number_input(
+                "Max canvas size (megapixels)", min_value=0.0, value=0.0, step=1.0,
+                help="Shrink the whole layout to stay under this size; 0 means no limit"
+            )
+            low_memory = st.checkbox(
+                "🪶 Low-memory mode",
+                value=False,
+                disabled=layout_mode != 'grid',
+                help="Build the collage one tile at a time instead of resizing every image up front (grid layout only)"
+            ) and layout_mode == 'grid'
+        
+        def collage_layout(records):
+            """Geometry from the stored headers; nothing is decoded"""
+            return compute_layout(
+                image_sizes(records), layout_mode, scale_factor, cols_per_row,
+                cell_size=cell_size, row_height=row_height, max_pixels=int(max_megapixels * 1_000_000) or None
+            )
         
         # Grid preview
-        if 'uploaded_images' in st.session_state and st.session_state.uploaded_images:
-            num_images = len(st.session_state.uploaded_images)
+        if 'upload_records' in st.session_state and st.session_state.upload_records:
+            num_images = len(st.session_state.upload_records)
             rows, cols = calculate_grid_size(num_images, cols_per_row)
+            preview_layout = collage_layout(st.session_state.upload_records)
             st.subheader("📊 Grid Preview")
-            preview_col1, preview_col2, preview_col3 = st.columns(3)
+            preview_col1, preview_col2, preview_col3, preview_col4 = st.columns(4)
             with preview_col1:
-                st.metric("Grid Layout", f"{rows} × {cols}")
+                st.metric("Grid Layout", f"{rows} × {cols}" if layout_mode != 'justified' else "Rows")
             with preview_col2:
                 st.metric("Total Images", num_images)
             with preview_col3:
                 st.metric("Resize Factor", f"{int(scale_factor * 100)}%")
+            with preview_col4:
+                st.metric("Canvas", f"{preview_layout.width} × {preview_layout.height}")
         
         st.divider()
     
@@ -287,65 +454,106 @@ def main():
         # File uploader
         uploaded_files = st.file_uploader(
             "Choose image files",
-            type=['png', 'jpg', 'jpeg'],
+            type=['png', 'jpg', 'jpeg', 'zip'],
             accept_multiple_files=True,
-            help="Select multiple PNG, JPG, or JPEG files"
+            help="Select multiple PNG, JPG, or JPEG files, or ZIP archives of them"
         )
         
         if uploaded_files:
             st.success(f"✅ {len(uploaded_files)} files uploaded successfully!")
             
-            # Validate and process images
-            valid_images = []
-            invalid_files = []
+            # Ingest each upload once; reruns reuse the stored records, and files any
+            # session has already uploaded are served from the shared store
+            ingested = st.session_state.setdefault('ingested_uploads', {})
+            upload_store = get_upload_store()
+            if 'store_lease' not in st.session_state:
+                st.session_state.store_lease = upload_store.lease()
+            new_files = [f for f in uploaded_files if f.file_id not in ingested]
             
-            progress_bar = st.progress(0)
-            status_text = st.empty()
-            
-            for i, uploaded_file in enumerate(uploaded_files):
-                status_text.text(f"Processing {uploaded_file.name}...")
-                progress_bar.progress((i + 1) / len(uploaded_files))
+            if new_files:
+                progress_bar = st.progress(0)
+                status_text = st.empty()
                 
-                is_valid, error_msg = validate_image(uploaded_file)
-                if is_valid:
-                    try:
-                        image = Image.open(uploaded_file)
-                        valid_images.append(image)
-                    except Exception as e:
-                        invalid_files.append(f"{uploaded_file.name}: {str(e)}")
-                else:
-                    invalid_files.append(f"{uploaded_file.name}: {error_msg}")
+                # ZIP archives expand into their image members; thumbnails decode in parallel
+                with ThreadPoolExecutor() as pool:
+                    futures = {pool.submit(ingest_upload, f, upload_store): f for f in new_files}
+                    for i, future in enumerate(as_completed(futures)):
+                        uploaded_file = futures[future]
+                        status_text.text(f"Processed {uploaded_file.name}")
+                        progress_bar.progress((i + 1) / len(new_files))
+                        ingested[uploaded_file.file_id] = future.result()
+                
+                status_text.text("Processing complete!")
+                progress_bar.empty()
+                status_text.empty()
+            
+            # Forget uploads the user removed
+            current_ids = {f.file_id for f in uploaded_files}
+            removed_ids = [file_id for file_id in ingested if file_id not in current_ids]
+            for file_id in removed_ids:
+                del ingested[file_id]
             
-            status_text.text("Processing complete!")
-            progress_bar.empty()
-            status_text.empty()
+            # Keep uploads in order until the session's memory cap is reached
+            invalid_files = []
+            duplicate_files = []
+            upload_records = []
+            first_names = {}
+            used_bytes = session_usage([], *stored_outputs())
+            for uploaded_file in uploaded_files:
+                records, errors = ingested[uploaded_file.file_id]
+                # Exact duplicates share the first copy's bytes, so they cost nothing more
+                upload_bytes = sum(record_bytes(record) for record in {
+                    record.digest: record for record in records if record.digest not in first_names
+                }.values())
+                if used_bytes + upload_bytes > SESSION_CAP_BYTES:
+                    # Drop the rejected bytes now rather than holding them until the file is removed
+                    error = f"{uploaded_file.name}: exceeds this session's {SESSION_CAP_BYTES / 1024 / 1024:.0f} MB memory cap"
+                    ingested[uploaded_file.file_id] = ([], [error])
+                    invalid_files.append(error)
+                    continue
+                used_bytes += upload_bytes
+                for record in records:
+                    if record.digest in first_names:
+                        duplicate_files.append(f"{record.name} is identical to {first_names[record.digest]}")
+                    else:
+                        first_names[record.digest] = record.name
+                upload_records.extend(records)
+                invalid_files.extend(errors)
             
-            # Store valid images in session state
-            st.session_state.uploaded_images = valid_images
+            # Pin this session's uploads in the store and release the ones it dropped
+            st.session_state.store_lease.hold(first_names)
+            
+            # Store compressed bytes and metadata only; pixels are decoded when a collage is built
+            st.session_state.upload_records = upload_records
             
             # Show validation results
-            if valid_images:
-                st.success(f"✅ {len(valid_images)} images processed successfully!")
+            if upload_records:
+                st.success(f"✅ {len(upload_records)} images processed successfully!")
             
             if invalid_files:
                 st.error("❌ Some files could not be processed:")
                 for error in invalid_files:
                     st.write(f"• {error}")
             
+            if duplicate_files:
+                st.info("ℹ️ Duplicate images are stored once and resized once:")
+                for duplicate in duplicate_files:
+                    st.write(f"• {duplicate}")
+            
             # Show image thumbnails with reordering
-            if valid_images:
+            if upload_records:
                 st.subheader("📋 Uploaded Images Preview")
                 st.markdown("**💡 Tip:** Use the controls below to reorder your images before creating the collage")
                 
                 # Initialize image order in session state if not exists
-                if 'image_order' not in st.session_state or len(st.session_state.image_order) != len(valid_images):
-                    st.session_state.image_order = list(range(len(valid_images)))
+                if 'image_order' not in st.session_state or len(st.session_state.image_order) != len(upload_records):
+                    st.session_state.image_order = list(range(len(upload_records)))
                 
                 # Reordering controls
                 col_controls = st.columns([1, 1, 1, 2])
                 with col_controls[0]:
                     if st.button("🔄 Reset Order"):
-                        st.session_state.image_order = list(range(len(valid_images)))
+                        st.session_state.image_order = list(range(len(upload_records)))
                         st.rerun()
                 
                 with col_controls[1]:
@@ -364,14 +572,14 @@ def main():
                 move_cols = st.columns([2, 1, 2, 1])
                 with move_cols[0]:
                     move_from = st.selectbox("Move image from position:", 
-                                           options=range(1, len(valid_images) + 1),
+                                           options=range(1, len(upload_records) + 1),
                                            format_func=lambda x: f"Position {x}")
                 with move_cols[1]:
                     st.markdown("<br>", unsafe_allow_html=True)
                     move_button = st.button("➡️")
                 with move_cols[2]:
                     move_to = st.selectbox("To position:", 
-                                         options=range(1, len(valid_images) + 1),
+                                         options=range(1, len(upload_records) + 1),
                                          format_func=lambda x: f"Position {x}")
                 
                 if move_button and move_from != move_to:
@@ -385,72 +593,271 @@ def main():
                     st.session_state.image_order.insert(to_idx, item)
                     st.rerun()
                 
-                # Display thumbnails in current order
-                ordered_images = [valid_images[i] for i in st.session_state.image_order]
+                # Display thumbnails in current order; they were encoded once at ingest,
+                # so reordering only permutes image_order over cached bytes
+                ordered_thumbnails = [upload_records[i].thumbnail for i in st.session_state.image_order]
                 
                 num_cols = 4
-                for i in range(0, len(ordered_images), num_cols):
+                for i in range(0, len(ordered_thumbnails), num_cols):
                     cols = st.columns(num_cols)
                     for j, col in enumerate(cols):
-                        if i + j < len(ordered_images):
+                        if i + j < len(ordered_thumbnails):
                             with col:
-                                # Create thumbnail for preview
-                                thumb = ordered_images[i + j].copy()
-                                thumb.thumbnail((150, 150), Image.Resampling.LANCZOS)
                                 original_idx = st.session_state.image_order[i + j]
-                                st.image(thumb, caption=f"Pos {i + j + 1} (Original #{original_idx + 1})")
+                                st.image(ordered_thumbnails[i + j], caption=f"Pos {i + j + 1} (Original #{original_idx + 1})")
     
     with col2:
         st.header("🎨 Generate Collage")
         
-        if 'uploaded_images' in st.session_state and st.session_state.uploaded_images:
+        if 'upload_records' in st.session_state and st.session_state.upload_records:
+            run_in_background = st.checkbox(
+                "⏳ Render in background",
+                value=True,
+                help="Render collages that need new resizes on a worker process so the page stays "
+                     "responsive; reorders and column changes over cached tiles are redrawn here"
+            )
             if st.button("🚀 Create Collage", type="primary", use_container_width=True):
-                with st.spinner("Creating your collage..."):
-                    try:
-                        # Get images in the current order
-                        if 'image_order' in st.session_state:
-                            ordered_images = [st.session_state.uploaded_images[i] for i in st.session_state.image_order]
-                        else:
-                            ordered_images = st.session_state.uploaded_images
-                        
-                        # Create the collage
-                        collage = create_collage(ordered_images, scale_factor, cols_per_row)
+                # Get images in the current order, lazily opened from their stored bytes
+                records = st.session_state.upload_records
+                if 'image_order' in st.session_state:
+                    records = [records[i] for i in st.session_state.image_order]
+                ordered_images = [open_record(record) for record in records]
+                uses_layout = layout_mode != 'grid' or max_megapixels
+                # Canvases over the memory budget are exported to disk a strip at a time
+                export_mode = choose_export(collage_layout(records))
+                
+                # Only cold builds go to a worker; warm ones reuse this process's tiles and kept canvas
+                in_background = run_in_background and (
+                    export_mode != 'memory' or low_memory or count_missing_tiles(
+                        ordered_images, scale_factor, get_tile_cache(),
+                        state=None if uses_layout else st.session_state.get('collage_state'),
+                        layout=collage_layout(records) if uses_layout else None, quality=resample_quality
+                    ) > 0
+                )
+                if in_background:
+                    layout_options = None
+                    if uses_layout:
+                        layout_options = {
+                            'mode': layout_mode, 'cell_size': cell_size, 'row_height': row_height,
+                            'max_pixels': int(max_megapixels * 1_000_000) or None,
+                        }
+                    spec = {
+                        'images': [record.data for record in records], 'scale': scale_factor,
+                        'cols': cols_per_row, 'low_memory': low_memory, 'layout': layout_options,
+                        'export': export_mode if export_mode != 'memory' else None,
+                        'quality': resample_quality,
+                        # The job's tiles come back to seed the shared cache, so the next reorder stays warm
+                        'tile_budget': get_tile_cache().max_bytes // 4,
+                    }
+                    # Identical requests share one job, so a repeated click reuses its result
+                    key = hash_bytes(repr((
+                        [record.digest for record in records], scale_factor, cols_per_row, low_memory,
+                        layout_options, spec['export'], resample_quality
+                    )).encode())
+                    st.session_state.collage_job = get_job_queue().submit('collage', spec, key=key)
+                    st.session_state.last_run = None
+                else:
+                    with st.spinner("Creating your collage..."):
+                        try:
+                            # Create the collage, recording per-stage metrics when enabled
+                            export_dir = None
+                            with metrics.run('collage') as perf_run:
+                                if export_mode != 'memory':
+                                    # Too large for one canvas: written to disk a strip at a time into a new
+                                    # directory, which is deleted on failure or when the session ends
+                                    export_dir = tempfile.TemporaryDirectory(prefix='collage-export-')
+                                    collage = export_collage(
+                                        ordered_images, collage_layout(records), export_dir.name, export_mode,
+                                        quality=resample_quality
+                                    )
+                                elif low_memory:
+                                    collage = stream_collage(ordered_images, scale_factor, cols_per_row, quality=resample_quality)
+                                elif uses_layout:
+                                    # Each image is resized once, straight to its placement
+                                    collage = create_collage(
+                                        ordered_images, cache=get_tile_cache(), layout=collage_layout(records),
+                                        quality=resample_quality
+                                    )
+                                else:
+                                    # Reorders and column changes only redraw the cells that moved
+                                    collage_state = st.session_state.setdefault('collage_state', CollageState())
+                                    collage = create_collage(
+                                        ordered_images, scale_factor, cols_per_row,
+                                        cache=get_tile_cache(), state=collage_state, quality=resample_quality
+                                    )
+                            st.session_state.last_run = perf_run
+                            
+                            if isinstance(collage, ExportResult):
+                                replace_export_dir(export_dir)
+                                store_collage(collage.as_stored(), uuid.uuid4().hex)
+                                st.success("🎉 Collage created successfully!")
+                            elif collage:
+                                # Keep a fast lossless encode and a display preview instead of the canvas
+                                replace_export_dir()
+                                store_collage({
+                                    'png': encode_image(collage, 'PNG', compress_level=1).data,
+                                    'preview': encode_preview(collage),
+                                    'size': collage.size,
+                                }, uuid.uuid4().hex)
+                                del collage
+                                st.success("🎉 Collage created successfully!")
+                                
+                                # The kept canvas and tiles count towards the session cap; drop them when over
+                                collage_state = st.session_state.get('collage_state')
+                                if collage_state is not None and not low_memory and not uses_layout:
+                                    used_bytes = session_usage(st.session_state.upload_records, *stored_outputs())
+                                    if used_bytes + collage_state.nbytes() > SESSION_CAP_BYTES:
+                                        collage_state.clear()
+                                    elif collage_state.last_update:
+                                        update, cells = collage_state.last_update
+                                        st.caption({
+                                            'full': f"Built all {cells} cells",
+                                            'relayout': f"Re-laid out {cells} cells without resizing",
+                                            'cells': f"Redrew {cells} changed cells",
+                                        }[update])
+                            else:
+                                st.error("❌ Failed to create collage")
                         
-                        if collage:
-                            st.session_state.collage = collage
-                            st.success("🎉 Collage created successfully!")
-                        else:
-                            st.error("❌ Failed to create collage")
+                        except Exception as e:
+                            st.error(f"❌ Error creating collage: {str(e)}")
                     
-                    except Exception as e:
-                        st.error(f"❌ Error creating collage: {str(e)}")
+                cache_stats = get_tile_cache().stats()
+                st.caption(
+                    f"Tile cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses, "
+                    f"{cache_stats['evictions']} evictions "
+                    f"({cache_stats['bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB)"
+                )
+            
+            # The fragment polls the job on its own until it finishes
+            show_job_error('collage_job')
+            if 'collage_job' in st.session_state:
+                show_job_progress('collage_job', store_collage_result)
             
             # Display the collage if it exists
             if 'collage' in st.session_state:
                 st.subheader("🖼️ Your Collage")
-                st.image(st.session_state.collage, caption="Generated Collage", use_container_width=True)
+                stored = st.session_state.collage
+                st.image(stored['preview'], caption=f"Generated Collage ({stored['size'][0]}×{stored['size'][1]})", use_container_width=True)
+            
+            if 'collage' in st.session_state and 'export' in st.session_state.collage:
+                exported = st.session_state.collage['export']
+                width, height = st.session_state.collage['size']
+                if exported['mode'] == 'dzi':
+                    st.info(f"📐 At {width * height / 1e6:.0f} megapixels this collage was exported as a Deep Zoom tile pyramid (open collage.dzi with a viewer such as OpenSeadragon).")
+                else:
+                    st.info(f"📐 At {width * height / 1e6:.0f} megapixels this collage was written as a PNG one strip at a time.")
+                try:
+                    with open(exported['path'], 'rb') as export_file:
+                        st.download_button(
+                            label="💾 Download Collage",
+                            data=export_file,
+                            file_name=os.path.basename(exported['path']),
+                            mime=exported['mime'],
+                            type="primary",
+                            use_container_width=True
+                        )
+                except OSError as e:
+                    st.error(f"❌ Error preparing download: {str(e)}")
+            elif 'collage' in st.session_state:
+                # Output format settings, read back by encode_options
+                format_cols = st.columns(2)
+                with format_cols[0]:
+                    output_format = st.selectbox(
+                        "Download format",
+                        options=list(OUTPUT_FORMATS.keys()),
+                        key="output_format",
+                        help="PNG is lossless; JPEG and WebP are much smaller and faster to encode"
+                    )
+                with format_cols[1]:
+                    if output_format == 'PNG':
+                        st.slider(
+                            "PNG compression level", min_value=0, max_value=9, value=6, key="png_compress_level",
+                            help="Lower levels encode faster but produce larger files"
+                        )
+                    else:
+                        lossless = False
+                        if output_format == 'WEBP':
+                            lossless = st.checkbox("Lossless WebP", value=False, key="webp_lossless")
+                        if not lossless:
+                            st.slider("Quality", min_value=50, max_value=100, value=90, step=5, key="encode_quality")
                 
                 # Download button
                 try:
-                    # Convert collage to bytes
-                    img_buffer = io.BytesIO()
-                    st.session_state.collage.save(img_buffer, format='PNG')
-                    img_bytes = img_buffer.getvalue()
-                    
-                    st.download_button(
-                        label="💾 Download Collage",
-                        data=img_bytes,
-                        file_name="image_collage.png",
-                        mime="image/png",
-                        type="primary",
-                        use_container_width=True
-                    )
+                    # Encode once per collage version in the background; reruns reuse the bytes
+                    future = submit_encode()
+                    if not future.done():
+                        # The page stays usable while the encode runs; the button appears once it is done
+                        wait_for_encode(future)
+                    else:
+                        encoded = future.result()
+                        st.download_button(
+                            label="💾 Download Collage",
+                            data=encoded.data,
+                            file_name=f"image_collage.{encoded.extension}",
+                            mime=encoded.mime,
+                            type="primary",
+                            use_container_width=True
+                        )
+                        st.caption(f"{encoded.format}: {len(encoded.data) / 1024:.0f} KB, encoded in {encoded.seconds * 1000:.0f} ms")
                 
                 except Exception as e:
                     st.error(f"❌ Error preparing download: {str(e)}")
         
         else:
             st.info("👆 Upload images first to generate a collage")
+        
+        used_bytes = session_usage(st.session_state.get('upload_records', []), *stored_outputs())
+        if 'collage_state' in st.session_state:
+            used_bytes += st.session_state.collage_state.nbytes()
+        st.caption(
+            f"Session memory: {used_bytes / 1024 / 1024:.1f} / {SESSION_CAP_BYTES / 1024 / 1024:.0f} MB"
+        )
+        store_stats = get_upload_store().stats()
+        st.caption(
+            f"Shared upload store: {store_stats['entries']} images, {store_stats['shared']} in use by several sessions "
+            f"({store_stats['bytes'] / 1024 / 1024:.1f} / {store_stats['max_bytes'] / 1024 / 1024:.0f} MB)"
+        )
+        pool_stats = decode_pool_stats()
+        st.caption(
+            f"Decode buffers: {pool_stats['reused_blocks']} pixel blocks reused, "
+            f"{pool_stats['allocated_blocks']} allocated in this process "
+            f"({pool_stats['idle_bytes'] / 1024 / 1024:.0f} / {pool_stats['max_idle_bytes'] / 1024 / 1024:.0f} MB idle)"
+        )
+        
+        with st.expander("📈 Performance"):
+            collect_metrics = st.checkbox(
+                "Collect performance metrics",
+                value=metrics.is_enabled(),
+                help="Times every pipeline stage for all sessions on this server; off means near-zero overhead"
+            )
+            if collect_metrics != metrics.is_enabled():
+                metrics.enable(collect_metrics)
+            
+            last_run = st.session_state.get('last_run')
+            breakdown = last_run.breakdown() if last_run else {}
+            if breakdown:
+                st.markdown("**Last collage, by stage:**")
+                st.dataframe(
+                    [
+                        {
+                            "Stage": name,
+                            "Calls": entry['calls'],
+                            "Time (ms)": round(entry['seconds'] * 1000, 1),
+                            "In (MB)": round(entry['bytes_in'] / 1024 / 1024, 2),
+                            "Out (MB)": round(entry['bytes_out'] / 1024 / 1024, 2),
+                            "Peak RSS growth (MB)": round(entry['peak_rss_growth_bytes'] / 1024 / 1024, 1),
+                        }
+                        for name, entry in breakdown.items()
+                    ],
+                    use_container_width=True
+                )
+                st.caption(
+                    "Tile stages run in parallel, so their times add up to more than the wall time of the collage stage. "
+                    "Peak RSS growth is how far the rendering process's memory had grown since the collage started, "
+                    "sampled as each stage finished."
+                )
+            elif collect_metrics:
+                st.caption("Create a collage to see its stage breakdown.")
     
     # Instructions
         with st.expander("ℹ️ How to use this app"):
@@ -0,0 +1,74 @@
+"""Compare per-tile flattening, masked Image.paste and the NumPy canvas engine
+
+Run from the repository root:
+
+    python benchmarks/bench_composite.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collage.composite import composite_tiles
+from collage.core import calculate_grid_size, flatten_alpha
+
+TILE_COUNTS = [10, 100, 1000]
+TILE_SIZE = (160, 120)
+REPEATS = 3
+
+def make_tiles(count, transparent):
+    """Opaque RGB tiles, or half RGBA tiles with varying transparency"""
+    rng = np.random.default_rng(42)
+    tiles = []
+    for i in range(count):
+        pixels = rng.integers(0, 256, (TILE_SIZE[1], TILE_SIZE[0], 4), dtype=np.uint8)
+        tile = Image.fromarray(pixels, 'RGBA')
+        tiles.append(tile if transparent and i % 2 == 0 else tile.convert('RGB'))
+    return tiles
+
+def composite_paste(tiles, cols, cell_width, cell_height):
+    """The original path: flatten each tile on its own white image, then paste"""
+    rows = -(-len(tiles) // cols)
+    collage = Image.new('RGB', (cols * cell_width, rows * cell_height), (255, 255, 255))
+    for i, tile in enumerate(tiles):
+        collage.paste(flatten_alpha(tile), ((i % cols) * cell_width, (i // cols) * cell_height))
+    return collage
+
+def composite_masked(tiles, cols, cell_width, cell_height):
+    """The paste engine: paste tiles onto the white canvas using their own alpha as mask"""
+    rows = -(-len(tiles) // cols)
+    collage = Image.new('RGB', (cols * cell_width, rows * cell_height), (255, 255, 255))
+    for i, tile in enumerate(tiles):
+        mask = tile if tile.mode in ('RGBA', 'LA') else None
+        collage.paste(tile, ((i % cols) * cell_width, (i // cols) * cell_height), mask)
+    return collage
+
+def best_time(function, *args):
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    print(f"{'tiles':>6} {'alpha':>6} {'flatten ms':>11} {'masked ms':>10} {'numpy ms':>9}")
+    for count in TILE_COUNTS:
+        for transparent in (False, True):
+            tiles = make_tiles(count, transparent)
+            rows, cols = calculate_grid_size(count)
+            args = (tiles, cols, TILE_SIZE[0], TILE_SIZE[1])
+            paste_time = best_time(composite_paste, *args)
+            masked_time = best_time(composite_masked, *args)
+            numpy_time = best_time(composite_tiles, *args)
+            print(
+                f"{count:>6} {'mixed' if transparent else 'none':>6} {paste_time * 1000:>11.1f} "
+                f"{masked_time * 1000:>10.1f} {numpy_time * 1000:>9.1f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Compare decoding with and without pooled pixel buffers
+
+Decodes and resizes the same JPEGs repeatedly, first returning every
+freed pixel block to the allocator (Pillow's default), then keeping them
+for reuse with collage.memory.pool_decode_buffers. Minor page faults
+count the fresh memory each decode has to touch.
+
+Run from the repository root:
+
+    python benchmarks/bench_decode_pool.py
+"""
+import io
+import os
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_draft_decode import make_jpeg
+from collage import resize_image
+from collage.memory import decode_pool_stats, pool_decode_buffers
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# (source size, scale factor): a draft-decoded downscale and full-resolution decodes
+CASES = [((4000, 3000), 0.45), ((4000, 3000), 0.9), ((6000, 4000), 0.9)]
+IMAGES = 8
+REPEATS = 3
+
+def page_faults():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_minflt if resource else 0
+
+def time_resizes(payloads, scale_factor):
+    """Best wall time of one pass over payloads, and the mean page faults per pass"""
+    best = float('inf')
+    start_faults = page_faults()
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        for data in payloads:
+            resize_image(Image.open(io.BytesIO(data)), scale_factor)
+        best = min(best, time.perf_counter() - start)
+    return best, (page_faults() - start_faults) // REPEATS
+
+def main():
+    print(f"{'source':>11} {'scale':>6} {'fresh ms':>10} {'faults':>8} {'pooled ms':>10} {'faults':>8} {'reused':>7}")
+    for (width, height), scale_factor in CASES:
+        payloads = [make_jpeg(width, height)] * IMAGES
+        pool_decode_buffers(0)
+        fresh, fresh_faults = time_resizes(payloads, scale_factor)
+        pool_decode_buffers()
+        before = decode_pool_stats()['reused_blocks']
+        pooled, pooled_faults = time_resizes(payloads, scale_factor)
+        reused = decode_pool_stats()['reused_blocks'] - before
+        print(
+            f"{width}x{height:<6} {scale_factor:>6.2f} {fresh * 1000:>10.1f} {fresh_faults:>8} "
+            f"{pooled * 1000:>10.1f} {pooled_faults:>8} {reused:>7}"
+        )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compare full-resolution and draft-mode JPEG decoding in resize_image
+
+Run from the repository root:
+
+    python benchmarks/bench_draft_decode.py
+"""
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collage import resize_image
+
+SIZES = [(1920, 1080), (4000, 3000), (6000, 4000)]
+SCALE_FACTORS = [0.45, 0.25, 0.1]
+REPEATS = 3
+
+def make_jpeg(width, height):
+    """Create a synthetic photo-like JPEG with smooth gradients and detail"""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    red = 127 + 127 * np.sin(x / 97.0)
+    green = 127 + 127 * np.cos(y / 61.0)
+    blue = 127 + 127 * np.sin((x + y) / 23.0)
+    pixels = np.dstack([red, green, blue]).clip(0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+def psnr(reference, candidate):
+    """Peak signal-to-noise ratio between two RGB images in dB"""
+    a = np.asarray(reference, dtype=np.float64)
+    b = np.asarray(candidate, dtype=np.float64)
+    mse = np.mean((a - b) ** 2)
+    if mse == 0:
+        return float('inf')
+    return 10 * np.log10(255.0 ** 2 / mse)
+
+def time_resize(data, scale_factor, draft):
+    """Return the best wall time and the output of resize_image"""
+    best = float('inf')
+    result = None
+    for _ in range(REPEATS):
+        image = Image.open(io.BytesIO(data))
+        start = time.perf_counter()
+        result = resize_image(image, scale_factor, draft=draft)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    print(f"{'source':>11} {'scale':>6} {'full ms':>9} {'draft ms':>9} {'speedup':>8} {'PSNR dB':>8}")
+    for width, height in SIZES:
+        data = make_jpeg(width, height)
+        for scale_factor in SCALE_FACTORS:
+            full_time, full_image = time_resize(data, scale_factor, draft=False)
+            draft_time, draft_image = time_resize(data, scale_factor, draft=True)
+            print(
+                f"{width}x{height:<6} {scale_factor:>6.2f} {full_time * 1000:>9.1f} "
+                f"{draft_time * 1000:>9.1f} {full_time / draft_time:>7.1f}x "
+                f"{psnr(full_image, draft_image):>8.1f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+"""Measure cold import time of the CLI path and check it stays lightweight
+
+Run from the repository root:
+
+    python benchmarks/bench_import.py
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('streamlit', 'numpy')
+REPEATS = 5
+
+def import_time_us(module):
+    """Cumulative import time of module in a fresh interpreter, in microseconds"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    )
+    for line in result.stderr.splitlines():
+        parts = [part.strip() for part in line.split('|')]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise RuntimeError(f"no import time reported for {module}")
+
+def loaded_heavy_modules(module):
+    """Heavy modules pulled in by importing module"""
+    code = f"import sys, {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return [name for name in result.stdout.strip().split(',') if name]
+
+def main():
+    best = min(import_time_us('collage.cli') for _ in range(REPEATS))
+    print(f"collage.cli cold import: {best / 1000:.1f} ms (best of {REPEATS})")
+    heavy = loaded_heavy_modules('collage.cli')
+    if heavy:
+        print(f"❌ CLI path imports {', '.join(heavy)}")
+        return 1
+    print("✅ CLI path imports neither streamlit nor numpy")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""Regression benchmark for upload ingest time per megabyte
+
+Compares the single-pass ingest stage, which also encodes the preview
+thumbnail, with the original validate-then-open loop (which made no
+thumbnails). Pass --max-ms-per-mb to fail when ingest gets slower than a budget.
+
+Run from the repository root:
+
+    python benchmarks/bench_ingest.py --max-ms-per-mb 250
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collage.core import validate_image
+from collage.ingest import ingest_bytes
+
+REPEATS = 5
+
+def make_uploads(count=40, size=(2400, 1600)):
+    """Encoded JPEG and PNG uploads of a realistic size"""
+    uploads = []
+    for i in range(count):
+        image = Image.linear_gradient('L').resize(size).convert('RGB')
+        image.paste((i * 5 % 256, 80, 160), (0, 0, size[0] // 4, size[1] // 4))
+        fmt = 'PNG' if i % 4 == 0 else 'JPEG'
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt)
+        uploads.append((f"upload_{i}.{fmt.lower()}", buffer.getvalue()))
+    return uploads
+
+def original_loop(uploads):
+    """validate_image (open + verify), then Image.open again"""
+    for name, data in uploads:
+        upload = io.BytesIO(data)
+        is_valid, _ = validate_image(upload)
+        if is_valid:
+            Image.open(upload)
+
+def ingest_loop(uploads, known=None):
+    for name, data in uploads:
+        ingest_bytes(name, data, known)
+
+def best_time(function, *args):
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-ms-per-mb', type=float, default=None, help="fail if ingest exceeds this budget")
+    args = parser.parse_args()
+
+    uploads = make_uploads()
+    megabytes = sum(len(data) for _, data in uploads) / 1024 / 1024
+    known = {}
+    ingest_loop(uploads, known)
+
+    results = {
+        'validate + open': best_time(original_loop, uploads),
+        'ingest (new files)': best_time(ingest_loop, uploads),
+        'ingest (known hashes)': best_time(ingest_loop, uploads, known),
+    }
+    print(f"{len(uploads)} uploads, {megabytes:.1f} MB")
+    for label, seconds in results.items():
+        print(f"{label:>22}: {seconds * 1000:8.1f} ms  {seconds * 1000 / megabytes:6.2f} ms/MB")
+
+    ms_per_mb = results['ingest (new files)'] * 1000 / megabytes
+    if args.max_ms_per_mb is not None and ms_per_mb > args.max_ms_per_mb:
+        print(f"❌ ingest takes {ms_per_mb:.2f} ms/MB, budget is {args.max_ms_per_mb} ms/MB")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+"""Compare the speed and quality of the fast, balanced and best resampling tiers
+
+Images are decoded up front so only the resampler is timed. PSNR is
+measured against the best (plain LANCZOS) output.
+
+Run from the repository root:
+
+    python benchmarks/bench_resample.py
+"""
+import io
+import os
+import sys
+import time
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_draft_decode import make_jpeg, psnr
+from collage import resize_single_image
+
+# (source size, scale factor): four downscales, including the collage slider's range, and two upscales
+CASES = [
+    ((4000, 3000), 0.1),
+    ((4000, 3000), 0.25),
+    ((4000, 3000), 0.3),
+    ((4000, 3000), 0.45),
+    ((1000, 750), 2.0),
+    ((1000, 750), 4.0),
+]
+TIERS = ['best', 'balanced', 'fast']
+REPEATS = 3
+
+def time_tier(image, scale_factor, quality):
+    """Return the best wall time and the output of resize_single_image"""
+    best = float('inf')
+    result = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = resize_single_image(image, scale_factor, quality=quality)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def main():
+    header = f"{'source':>11} {'scale':>6}"
+    for tier in TIERS:
+        header += f" {tier + ' ms':>12}"
+        if tier != 'best':
+            header += f" {'PSNR dB':>8}"
+    print(header)
+    for (width, height), scale_factor in CASES:
+        image = Image.open(io.BytesIO(make_jpeg(width, height))).convert('RGB')
+        row = f"{width}x{height:<6} {scale_factor:>6.2f}"
+        reference = None
+        for tier in TIERS:
+            elapsed, result = time_tier(image, scale_factor, tier)
+            row += f" {elapsed * 1000:>12.1f}"
+            if reference is None:
+                reference = result
+            else:
+                row += f" {psnr(reference, result):>8.1f}"
+        print(row)
+
+if __name__ == "__main__":
+    main()
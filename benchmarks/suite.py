@@ -0,0 +1,321 @@
+"""Reproducible benchmark suite for the collage and resize pipeline
+
+Generates synthetic inputs that vary in count, resolution, mode
+(RGB/RGBA/P/L/CMYK) and format, then times each pipeline stage (decode,
+convert, resize, paste, encode) and the public entry points
+(create_collage, resize_image, resize_single_image, calculate_grid_size).
+For every measurement it records wall time, CPU time and how far the
+resident set grew above its starting size while the measurement ran, and
+writes JSON results that can be compared between commits.
+
+Run from the repository root:
+
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --output after.json --compare before.json
+    python benchmarks/suite.py --quick --profile cprofile --profile-dir profiles/
+"""
+import argparse
+import cProfile
+import ctypes
+import ctypes.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import PIL
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from collage.core import (
+    calculate_grid_size,
+    create_collage,
+    flatten_alpha,
+    paste_tiles,
+    resize_image,
+    resize_single_image,
+    scaled_size,
+)
+from collage.encode import encode_image
+from collage.metrics import current_rss_bytes
+
+SCALE_FACTOR = 0.45
+COLS_PER_ROW = 5
+
+# (mode, format) pairs; each mode is stored the way it would normally arrive
+INPUT_KINDS = [
+    ('RGB', 'JPEG'),
+    ('RGB', 'PNG'),
+    ('RGBA', 'PNG'),
+    ('P', 'PNG'),
+    ('L', 'JPEG'),
+    ('CMYK', 'JPEG'),
+]
+FULL_MATRIX = {'counts': [10, 50], 'resolutions': [(1280, 960), (4000, 3000)]}
+QUICK_MATRIX = {'counts': [10], 'resolutions': [(1280, 960)]}
+
+def synthetic_image(width, height, mode, seed):
+    """Photo-like content: smooth gradients, some detail and, for RGBA, a soft alpha edge"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    phase = rng.uniform(0, 6.28, 3)
+    channels = [127 + 127 * np.sin(x / (60 + 20 * i) + y / (90 - 15 * i) + phase[i]) for i in range(3)]
+    rgb = np.dstack(channels).clip(0, 255).astype(np.uint8)
+    image = Image.fromarray(rgb, 'RGB')
+    if mode == 'RGBA':
+        alpha = (255 * np.clip(x / width * 2, 0, 1)).astype(np.uint8)
+        image.putalpha(Image.fromarray(alpha, 'L'))
+        return image
+    if mode == 'P':
+        return image.quantize(64)
+    return image.convert(mode)
+
+def make_inputs(count, resolution, mode, fmt):
+    """Encode count synthetic images; a few distinct sources are reused to keep setup fast"""
+    distinct = []
+    for seed in range(min(count, 4)):
+        buffer = io.BytesIO()
+        synthetic_image(*resolution, mode, seed).save(buffer, format=fmt)
+        distinct.append(buffer.getvalue())
+    return [distinct[i % len(distinct)] for i in range(count)]
+
+def release_freed_memory():
+    """Hand freed heap pages back to the OS (glibc only), so later allocations show up as RSS growth"""
+    try:
+        ctypes.CDLL(ctypes.util.find_library('c')).malloc_trim(0)
+    except (OSError, AttributeError, TypeError):
+        pass
+
+class RssSampler:
+    """Peak growth of the resident set above its size on entry, sampled on a background thread
+
+    The process high-water mark (ru_maxrss) only ever rises, so after the
+    largest stage every later stage would report the same value. Pillow's
+    pixel buffers are invisible to tracemalloc, so RSS is sampled instead.
+    Where /proc is unavailable the growth is reported as 0.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.start = 0
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        release_freed_memory()
+        self.start = self.peak = current_rss_bytes()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_bytes())
+        return False
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    @property
+    def growth_mb(self):
+        return (self.peak - self.start) / 1024 / 1024
+
+class Recorder:
+    """Times named stages, with optional cProfile or tracemalloc hooks"""
+
+    def __init__(self, repeats=3, profile=None, profile_dir=None):
+        self.repeats = repeats
+        self.profile = profile
+        self.profile_dir = profile_dir
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def measure(self, case, stage, function, *args):
+        """Run function(*args), returning (result, metrics) with the best of several runs"""
+        profiler = None
+        if self.profile == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        elif self.profile == 'tracemalloc':
+            tracemalloc.start()
+
+        metrics = {'wall_s': float('inf'), 'cpu_s': float('inf'), 'rss_growth_mb': 0.0}
+        for _ in range(self.repeats):
+            # Drop the previous run's result first so it doesn't hide this run's allocations
+            result = None
+            with RssSampler() as sampler:
+                wall_start = time.perf_counter()
+                cpu_start = time.process_time()
+                result = function(*args)
+                metrics['wall_s'] = min(metrics['wall_s'], time.perf_counter() - wall_start)
+                metrics['cpu_s'] = min(metrics['cpu_s'], time.process_time() - cpu_start)
+            metrics['rss_growth_mb'] = max(metrics['rss_growth_mb'], sampler.growth_mb)
+
+        if profiler is not None:
+            profiler.disable()
+            if self.profile_dir:
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{case}.{stage}.prof"))
+        elif self.profile == 'tracemalloc':
+            # Pillow's pixel buffers are not traced; this covers Python-side allocations
+            metrics['traced_peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+            tracemalloc.stop()
+        return result, metrics
+
+def run_case(recorder, count, resolution, mode, fmt):
+    """Time every stage for one input configuration"""
+    case = f"{mode}-{fmt}-{resolution[0]}x{resolution[1]}-n{count}"
+    encoded = make_inputs(count, resolution, mode, fmt)
+    rows, cols = calculate_grid_size(count, COLS_PER_ROW)
+    stages = {}
+
+    # Each stage works on the previous stage's output, which is never modified
+    def decode():
+        images = [Image.open(io.BytesIO(data)) for data in encoded]
+        for image in images:
+            image.load()
+        return images
+
+    def convert(images):
+        return [flatten_alpha(image) for image in images]
+
+    def resize(images):
+        return [image.resize(scaled_size(image, SCALE_FACTOR), Image.Resampling.LANCZOS) for image in images]
+
+    def paste(tiles):
+        return paste_tiles(tiles, cols, max(t.width for t in tiles), max(t.height for t in tiles))
+
+    images, stages['decode'] = recorder.measure(case, 'decode', decode)
+    converted, stages['convert'] = recorder.measure(case, 'convert', convert, images)
+    tiles, stages['resize'] = recorder.measure(case, 'resize', resize, converted)
+    collage, stages['paste'] = recorder.measure(case, 'paste', paste, tiles)
+    _, stages['encode'] = recorder.measure(case, 'encode', encode_image, collage, 'PNG')
+    del images, converted, tiles
+
+    # Public entry points; every run opens fresh, lazily decoded inputs
+    lazy = lambda: [Image.open(io.BytesIO(data)) for data in encoded]
+    entry_points = {
+        'create_collage': lambda: create_collage(lazy(), SCALE_FACTOR, COLS_PER_ROW),
+        'create_collage_serial': lambda: create_collage(lazy(), SCALE_FACTOR, COLS_PER_ROW, executor=None),
+        'resize_image': lambda: [resize_image(image, SCALE_FACTOR) for image in lazy()],
+        'resize_single_image': lambda: [resize_single_image(image, 0.5) for image in lazy()],
+    }
+    for stage, function in entry_points.items():
+        _, stages[stage] = recorder.measure(case, stage, function)
+
+    return case, {
+        'count': count, 'width': resolution[0], 'height': resolution[1], 'mode': mode, 'format': fmt,
+        'input_bytes': sum(len(data) for data in encoded),
+        'output_size': list(collage.size),
+        'stages': stages,
+    }
+
+def time_grid_size(recorder):
+    """calculate_grid_size is pure arithmetic, so time many calls at once"""
+    def calls():
+        for num_images in range(1, 100001):
+            calculate_grid_size(num_images % 500, None if num_images % 2 else 4)
+    _, metrics = recorder.measure('grid', 'calculate_grid_size_100k', calls)
+    return metrics
+
+def environment():
+    """Enough context to tell whether two result files are comparable"""
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+def compare(results, baseline, threshold, memory_slack_mb=8.0):
+    """Print wall-time and memory ratios against a baseline run, returning the number of regressions
+
+    Memory counts as regressed past threshold times the baseline plus
+    memory_slack_mb, since small stages sit within the allocator's noise.
+    """
+    regressions = 0
+    print(f"\n{'case':<32} {'stage':<22} {'base ms':>9} {'now ms':>9} {'ratio':>6} {'base MB':>8} {'now MB':>8}")
+    for case, data in results['cases'].items():
+        base_case = baseline.get('cases', {}).get(case)
+        if not base_case:
+            continue
+        for stage, metrics in data['stages'].items():
+            base = base_case['stages'].get(stage)
+            if not base or base['wall_s'] == 0:
+                continue
+            ratio = metrics['wall_s'] / base['wall_s']
+            base_mb = base.get('rss_growth_mb')
+            now_mb = metrics['rss_growth_mb']
+            memory_regressed = base_mb is not None and now_mb > base_mb * threshold + memory_slack_mb
+            flag = ' ❌' if ratio > threshold or memory_regressed else ''
+            regressions += bool(flag)
+            base_column = f"{base_mb:>8.1f}" if base_mb is not None else f"{'-':>8}"
+            print(
+                f"{case:<32} {stage:<22} {base['wall_s'] * 1000:>9.1f} {metrics['wall_s'] * 1000:>9.1f} {ratio:>6.2f} "
+                f"{base_column} {now_mb:>8.1f}{flag}"
+            )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collage and resize pipeline.")
+    parser.add_argument('--quick', action='store_true', help="small matrix for a fast smoke run")
+    parser.add_argument('--modes', nargs='*', help="only these input modes, e.g. RGB CMYK")
+    parser.add_argument('--repeats', type=int, default=3, help="runs per stage; the fastest is kept (default: 3)")
+    parser.add_argument('--output', help="write results as JSON")
+    parser.add_argument('--compare', help="baseline JSON to compare wall times against")
+    parser.add_argument('--threshold', type=float, default=1.15, help="ratio that counts as a regression (default: 1.15)")
+    parser.add_argument('--profile', choices=['cprofile', 'tracemalloc'], help="profile every stage")
+    parser.add_argument('--profile-dir', help="where cProfile writes one .prof file per stage")
+    args = parser.parse_args()
+
+    matrix = QUICK_MATRIX if args.quick else FULL_MATRIX
+    kinds = [kind for kind in INPUT_KINDS if not args.modes or kind[0] in args.modes]
+    recorder = Recorder(args.repeats, args.profile, args.profile_dir)
+
+    results = {'environment': environment(), 'repeats': args.repeats, 'cases': {}}
+    results['grid'] = time_grid_size(recorder)
+    for resolution in matrix['resolutions']:
+        for count in matrix['counts']:
+            for mode, fmt in kinds:
+                case, data = run_case(recorder, count, resolution, mode, fmt)
+                results['cases'][case] = data
+                summary = '  '.join(
+                    f"{stage} {m['wall_s'] * 1000:.0f}ms/{m['rss_growth_mb']:.0f}MB" for stage, m in data['stages'].items()
+                )
+                print(f"{case:<32} {summary}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output:
+            json.dump(results, output, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ {regressions} stage(s) slower, or using more memory, than {args.threshold:.2f}x the baseline")
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,40 @@
+"""Streamlit-free core of the image collage generator and resizer"""
+from .cache import TileCache, tile_key
+from .core import (
+    calculate_grid_size,
+    count_missing_tiles,
+    create_collage,
+    draft_decode,
+    resize_image,
+    resize_single_image,
+    resize_tiles,
+    scaled_size,
+    validate_image,
+)
+from .incremental import CollageState
+from .resample import DEFAULT_QUALITY, QUALITY_TIERS, resample
+from .sources import content_hash, image_payload, reopen_image
+from .streaming import stream_collage, write_png_bands
+
+__all__ = [
+    'CollageState',
+    'DEFAULT_QUALITY',
+    'QUALITY_TIERS',
+    'TileCache',
+    'calculate_grid_size',
+    'content_hash',
+    'count_missing_tiles',
+    'create_collage',
+    'draft_decode',
+    'image_payload',
+    'reopen_image',
+    'resample',
+    'resize_image',
+    'resize_single_image',
+    'resize_tiles',
+    'scaled_size',
+    'stream_collage',
+    'tile_key',
+    'validate_image',
+    'write_png_bands',
+]
@@ -0,0 +1,118 @@
+"""ZIP ingest and batch ZIP export for bulk resizing
+
+Archives are checked against their headers before anything is
+decompressed: a member over ``COLLAGE_ZIP_MEMBER_CAP_MB`` (default 128)
+or images totalling more than ``COLLAGE_ZIP_CAP_MB`` (default 512)
+uncompressed reject the whole archive, so a small ZIP bomb cannot exhaust
+memory.
+"""
+import io
+import os
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from .core import resize_single_image
+from .encode import encode_image
+from .resample import DEFAULT_QUALITY
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MAX_MEMBER_BYTES = int(os.environ.get('COLLAGE_ZIP_MEMBER_CAP_MB', '128')) * 1024 * 1024
+MAX_ARCHIVE_BYTES = int(os.environ.get('COLLAGE_ZIP_CAP_MB', '512')) * 1024 * 1024
+
+def is_zip_name(name):
+    return name.lower().endswith('.zip')
+
+def iter_zip_images(fileobj, max_member_bytes=MAX_MEMBER_BYTES, max_archive_bytes=MAX_ARCHIVE_BYTES):
+    """Yield (member name, file-like) for each image in a ZIP, one member at a time
+
+    Raises ValueError, before reading any member, if one image member or
+    all of them together would decompress to more than the limits.
+    """
+    # ZipFile seeks within fileobj, so only the member being read is held in memory
+    with zipfile.ZipFile(fileobj) as archive:
+        members = [info for info in archive.infolist() if is_image_member(info)]
+        for info in members:
+            if info.file_size > max_member_bytes:
+                raise ValueError(
+                    f"{info.filename} is {info.file_size / 1024 / 1024:.0f} MB uncompressed, "
+                    f"over the {max_member_bytes / 1024 / 1024:.0f} MB limit per image"
+                )
+        total = sum(info.file_size for info in members)
+        if total > max_archive_bytes:
+            raise ValueError(
+                f"images are {total / 1024 / 1024:.0f} MB uncompressed, "
+                f"over the {max_archive_bytes / 1024 / 1024:.0f} MB limit per archive"
+            )
+        # ZipFile never returns more than a member's declared size, so the checks above bound memory
+        for info in members:
+            yield info.filename, io.BytesIO(archive.read(info))
+
+def is_image_member(info):
+    """Whether a ZIP member is an image file, skipping directories and macOS metadata"""
+    name = info.filename
+    if info.is_dir() or name.startswith('__MACOSX/') or os.path.basename(name).startswith('.'):
+        return False
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+def resized_name(name, scale_factor, extension):
+    """Output name inside the batch ZIP, e.g. shoot/img_0_5x.png"""
+    stem = name.rsplit('.', 1)[0]
+    scale_suffix = f"{scale_factor:g}x".replace('.', '_')
+    return f"{stem}_{scale_suffix}.{extension}"
+
+def unique_name(name, used):
+    """name, or name with a numeric suffix if an earlier member took it, e.g. a_0_5x_2.png"""
+    stem, dot, extension = name.rpartition('.')
+    candidate = name
+    counter = 2
+    while candidate in used:
+        candidate = f"{stem}_{counter}{dot}{extension}"
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+def resize_member(name, fileobj, scale_factor, fmt='PNG', quality=DEFAULT_QUALITY):
+    """Worker: decode, resize and encode one image, returning (name, bytes, error)"""
+    try:
+        resized_image = resize_single_image(Image.open(fileobj), scale_factor, quality=quality)
+        encoded = encode_image(resized_image, fmt)
+        return resized_name(name, scale_factor, encoded.extension), encoded.data, None
+    except Exception as e:
+        return name, None, str(e)
+
+def batch_resize_to_zip(sources, scale_factor, output, fmt='PNG', max_workers=None, progress=None,
+                        quality=DEFAULT_QUALITY):
+    """Resize (name, file-like) sources in parallel into one ZIP, returning a list of errors"""
+    max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+    errors = []
+    pending = deque()
+    # Sources with equal stems, such as a.jpg and a.png, map to the same resized name
+    used_names = set()
+    done = 0
+
+    # Encoded images are already compressed, so members are stored as is
+    with ThreadPoolExecutor(max_workers=max_workers) as pool, zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED) as archive:
+        sources = iter(sources)
+        while True:
+            # Keep a bounded window in flight so large shoots never pile up in memory
+            for name, fileobj in sources:
+                pending.append(pool.submit(resize_member, name, fileobj, scale_factor, fmt, quality))
+                if len(pending) >= max_workers * 2:
+                    break
+            if not pending:
+                break
+            
+            # Write results in input order as they complete
+            name, data, error = pending.popleft().result()
+            if error:
+                errors.append(f"{name}: {error}")
+            else:
+                name = unique_name(name, used_names)
+                archive.writestr(name, data)
+            done += 1
+            if progress:
+                progress(done, name)
+    return errors
@@ -0,0 +1,91 @@
+"""LRU cache of resized tiles shared across collages"""
+import threading
+from collections import OrderedDict
+
+from .resample import DEFAULT_QUALITY
+from .sources import content_hash
+
+def tile_key(image, scale_factor, draft=True, background=(255, 255, 255), quality=DEFAULT_QUALITY):
+    """Cache key: (content hash, scale factor, resampling quality tier, background colour, draft)
+
+    background is None for tiles that keep their alpha channel.
+    """
+    return (content_hash(image), scale_factor, quality, background, draft)
+
+class TileCache:
+    """Thread-safe LRU cache of resized tiles bounded by a byte budget"""
+    
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def tile_bytes(tile):
+        """Approximate decoded size of a tile"""
+        return tile.width * tile.height * len(tile.getbands())
+    
+    def __contains__(self, key):
+        """Whether key is cached, without counting a hit or refreshing it"""
+        with self._lock:
+            return key in self._tiles
+    
+    def items(self):
+        """Snapshot of (key, tile) pairs, least recently used first"""
+        with self._lock:
+            return list(self._tiles.items())
+    
+    def get(self, key):
+        """Return the cached tile for key, or None"""
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is None:
+                self.misses += 1
+                return None
+            self._tiles.move_to_end(key)
+            self.hits += 1
+            return tile
+    
+    def put(self, key, tile):
+        """Store a tile, evicting least recently used tiles over budget"""
+        size = self.tile_bytes(tile)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._tiles:
+                self.current_bytes -= self.tile_bytes(self._tiles.pop(key))
+            self._tiles[key] = tile
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._tiles.popitem(last=False)
+                self.current_bytes -= self.tile_bytes(evicted)
+                self.evictions += 1
+    
+    def discard(self, digests):
+        """Drop every tile resized from the given content hashes"""
+        digests = set(digests)
+        with self._lock:
+            for key in [key for key in self._tiles if key[0] in digests]:
+                self.current_bytes -= self.tile_bytes(self._tiles.pop(key))
+    
+    def clear(self):
+        """Drop every cached tile, keeping the counters"""
+        with self._lock:
+            self._tiles.clear()
+            self.current_bytes = 0
+    
+    def stats(self):
+        """Hit, miss and eviction counters plus current usage"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'tiles': len(self._tiles),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+            }
@@ -0,0 +1,188 @@
+"""Headless command line entry point for batch collage generation
+
+Examples:
+
+    collage photos/ -o collage.png --scale 0.3 --cols 4
+    collage "shoot/*.jpg" extra.png -o out.jpg
+    collage shoot.zip -o out.png
+    collage huge/ -o pyramid.dzi --scale 1
+    collage --manifest jobs.jsonl --jobs 8
+
+A manifest holds one JSON object per line with ``inputs`` (a list of
+files, ZIP archives, directories or globs), ``output`` and optionally ``scale``,
+``cols``, ``low_memory``, ``layout``, ``cell`` ([width, height]), ``row_height``,
+``max_megapixels`` and ``quality`` (fast, balanced or best).
+
+This module must stay free of Streamlit and NumPy so cold starts are cheap.
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from .archive import IMAGE_EXTENSIONS, is_zip_name, iter_zip_images
+from .core import create_collage
+from .export import choose_export, write_dzi, write_png_layout
+from .layout import LAYOUT_MODES, compute_layout, image_sizes
+from .memory import pool_decode_buffers
+from .resample import DEFAULT_QUALITY, QUALITY_TIERS
+from .streaming import stream_collage
+
+INPUT_EXTENSIONS = IMAGE_EXTENSIONS + ('.zip',)
+
+def expand_inputs(inputs):
+    """Expand files, directories and glob patterns into sorted image paths"""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            paths.extend(sorted(
+                os.path.join(item, name) for name in os.listdir(item)
+                if name.lower().endswith(INPUT_EXTENSIONS)
+            ))
+        elif glob.has_magic(item):
+            paths.extend(sorted(path for path in glob.glob(item) if path.lower().endswith(INPUT_EXTENSIONS)))
+        else:
+            paths.append(item)
+    return paths
+
+def read_manifest(manifest_path):
+    """Load collage jobs from a JSON lines manifest"""
+    jobs = []
+    with open(manifest_path, encoding='utf-8') as manifest:
+        for line_number, line in enumerate(manifest, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            job = json.loads(line)
+            if 'inputs' not in job or 'output' not in job:
+                raise ValueError(f"{manifest_path}:{line_number}: each job needs 'inputs' and 'output'")
+            jobs.append(job)
+    return jobs
+
+def run_job(job, executor=None):
+    """Build one collage and write it to disk, returning (output, error)"""
+    output = job['output']
+    try:
+        paths = expand_inputs(job['inputs'])
+        if not paths:
+            return output, "no input images"
+
+        # Hold only the encoded bytes so thousands of inputs don't exhaust file handles
+        images = []
+        for path in paths:
+            if is_zip_name(path):
+                images.extend(Image.open(member) for _, member in iter_zip_images(path))
+                continue
+            with open(path, 'rb') as image_file:
+                images.append(Image.open(io.BytesIO(image_file.read())))
+
+        scale_factor = job.get('scale', 0.45)
+        cols_per_row = job.get('cols')
+        layout_mode = job.get('layout') or 'grid'
+        max_megapixels = job.get('max_megapixels')
+        quality = job.get('quality') or DEFAULT_QUALITY
+        # Geometry comes from the headers; each image is then resized once to its placement
+        layout = compute_layout(
+            image_sizes(images), layout_mode, scale_factor, cols_per_row,
+            cell_size=tuple(job['cell']) if job.get('cell') else None,
+            row_height=job.get('row_height'),
+            max_pixels=int(max_megapixels * 1_000_000) if max_megapixels else None,
+        )
+        huge = choose_export(layout) != 'memory'
+        if output.lower().endswith('.dzi'):
+            write_dzi_files(images, layout, output, quality)
+        elif output.lower().endswith('.png') and (job.get('low_memory') or huge):
+            # Written a strip at a time, so the canvas is never materialized
+            with open(output, 'wb') as output_file:
+                write_png_layout(output_file, images, layout, quality=quality)
+        elif layout_mode != 'grid' or max_megapixels:
+            create_collage(images, executor=executor, layout=layout, quality=quality).save(output)
+        else:
+            if job.get('low_memory'):
+                collage = stream_collage(images, scale_factor, cols_per_row, quality=quality)
+            else:
+                collage = create_collage(images, scale_factor, cols_per_row, executor=executor, quality=quality)
+            collage.save(output)
+        return output, None
+    except Exception as e:
+        return output, str(e)
+
+def write_dzi_files(images, layout, output, quality=DEFAULT_QUALITY):
+    """Write output (a .dzi path) and its <name>_files tile directory"""
+    directory = os.path.dirname(output) or '.'
+    name = os.path.basename(output)[:-len('.dzi')]
+
+    def write(path, data):
+        path = os.path.join(directory, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as output_file:
+            output_file.write(data)
+    write_dzi(images, layout, write, name=name, quality=quality)
+
+def cell_size(value):
+    """Parse WIDTHxHEIGHT for --cell"""
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value!r}")
+    return width, height
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='collage', description="Create image grid collages without a browser.")
+    parser.add_argument('inputs', nargs='*', help="image files, ZIP archives, directories or glob patterns")
+    parser.add_argument('-o', '--output', help="output file; the format follows the extension (.dzi writes a tile pyramid)")
+    parser.add_argument('-m', '--manifest', help="JSON lines file with one collage job per line")
+    parser.add_argument('-s', '--scale', type=float, default=0.45, help="resize factor per image (default: 0.45)")
+    parser.add_argument('-c', '--cols', type=int, default=None, help="columns per row (default: square-ish grid)")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="worker processes for manifest jobs (default: CPU count)")
+    parser.add_argument('--low-memory', action='store_true', help="assemble tile by tile, streaming PNG output to disk")
+    parser.add_argument('--layout', choices=LAYOUT_MODES, default='grid', help="how tiles are sized and placed (default: grid)")
+    parser.add_argument('--cell', type=cell_size, default=None, help="cell size for fit/fill/crop layouts, e.g. 300x200")
+    parser.add_argument('--row-height', type=int, default=None, help="target row height for the justified layout")
+    parser.add_argument('--max-megapixels', type=float, default=None, help="shrink the layout to stay under this canvas size")
+    parser.add_argument('--quality', choices=QUALITY_TIERS, default=DEFAULT_QUALITY, help="resampling quality tier (default: balanced)")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    defaults = {
+        'scale': args.scale, 'cols': args.cols, 'low_memory': args.low_memory, 'layout': args.layout,
+        'cell': args.cell, 'row_height': args.row_height, 'max_megapixels': args.max_megapixels,
+        'quality': args.quality,
+    }
+    if args.manifest:
+        if args.inputs or args.output:
+            parser.error("use either --manifest or inputs with --output, not both")
+        try:
+            manifest_jobs = read_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            parser.error(f"invalid manifest: {e}")
+        jobs = [{**defaults, **job} for job in manifest_jobs]
+    elif args.inputs and args.output:
+        jobs = [{**defaults, 'inputs': args.inputs, 'output': args.output}]
+    else:
+        parser.error("give inputs and --output, or --manifest")
+
+    # A single collage parallelizes over its tiles, many collages over jobs
+    if len(jobs) == 1:
+        pool_decode_buffers()
+        results = [run_job(jobs[0], executor='thread')]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs, initializer=pool_decode_buffers) as pool:
+            results = pool.map(run_job, jobs, chunksize=max(1, len(jobs) // 256))
+
+    failures = 0
+    for output, error in results:
+        if error:
+            failures += 1
+            print(f"❌ {output}: {error}", file=sys.stderr)
+        else:
+            print(f"✅ {output}")
+    return 1 if failures else 0
@@ -0,0 +1,49 @@
+"""Vectorized NumPy compositing of collage tiles onto a white canvas
+
+Kept out of the package's top-level imports so that NumPy is only loaded
+when this engine is actually used.
+"""
+import numpy as np
+from PIL import Image
+
+def blend_onto_white(target, pixels, alpha):
+    """Alpha-blend uint8 pixels onto white, writing into a canvas slice"""
+    # Fully opaque tiles (the common case for photos) need no blending
+    if alpha.min() == 255:
+        target[...] = pixels
+        return
+
+    # 255 - round((255 - c) * a / 255), with the division done by shifts
+    blended = np.subtract(255, pixels, dtype=np.uint16)
+    blended *= alpha
+    blended += 128
+    blended += blended >> 8
+    blended >>= 8
+    np.subtract(255, blended, out=blended)
+    target[...] = blended
+
+def composite_tiles(tiles, cols, cell_width, cell_height):
+    """Paste tiles row-major into a white grid of cells, returning one RGB image"""
+    rows = -(-len(tiles) // cols)
+
+    # One preallocated canvas; every tile is written straight into its slice
+    canvas = np.full((rows * cell_height, cols * cell_width, 3), 255, dtype=np.uint8)
+
+    for i, tile in enumerate(tiles):
+        x = (i % cols) * cell_width
+        y = (i // cols) * cell_height
+        pixels = np.asarray(tile)
+        target = canvas[y:y + tile.height, x:x + tile.width]
+
+        if tile.mode == 'RGB':
+            target[...] = pixels
+        elif tile.mode == 'RGBA':
+            blend_onto_white(target, pixels[..., :3], pixels[..., 3:])
+        elif tile.mode == 'L':
+            target[...] = pixels[..., None]
+        elif tile.mode == 'LA':
+            blend_onto_white(target, pixels[..., :1], pixels[..., 1:])
+        else:
+            target[...] = np.asarray(tile.convert('RGB'))
+
+    return Image.fromarray(canvas, 'RGB')
@@ -0,0 +1,376 @@
+"""Grid layout and resizing primitives for image collages
+
+This module has no Streamlit or NumPy dependency so it can be imported
+cheaply from the command line and from batch jobs.
+"""
+import io
+import math
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from PIL import Image
+
+from . import metrics
+from .cache import tile_key
+from .resample import DEFAULT_QUALITY, resample
+from .sources import image_payload
+
+def calculate_grid_size(num_images, cols_per_row=None):
+    """Calculate grid dimensions for given number of images"""
+    if num_images == 0:
+        return 0, 0
+    elif num_images == 1:
+        return 1, 1
+    else:
+        if cols_per_row:
+            # Use specified columns per row
+            cols = cols_per_row
+            rows = math.ceil(num_images / cols)
+        else:
+            # Calculate square root and round up for rows (default behavior)
+            sqrt_num = math.sqrt(num_images)
+            rows = math.ceil(sqrt_num)
+            cols = math.ceil(num_images / rows)
+        return rows, cols
+
+def draft_decode(image, size):
+    """Decode a JPEG at the smallest DCT scale that still covers size"""
+    # Only lazily opened JPEGs can be decoded at a reduced scale
+    if image.format != 'JPEG' or getattr(image, 'fp', None) is None:
+        return image, None
+    
+    # Open a fresh decoder so the caller's image keeps its full resolution
+    image.fp.seek(0)
+    draft_image = Image.open(image.fp)
+    result = draft_image.draft(None, size)
+    if result is None:
+        return image, None
+    draft_image.load()
+    
+    # The returned box maps the original frame onto the reduced pixels
+    return draft_image, result[1]
+
+def flatten_alpha(image):
+    """Convert an image to RGB, flattening any transparency onto white"""
+    # Convert to RGB if necessary (for PNG with transparency)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        # Create a white background
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        if image.mode == 'P':
+            image = image.convert('RGBA')
+        background.paste(image, mask=image.split()[-1] if image.mode == 'RGBA' else None)
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    return image
+
+def tile_mode(image):
+    """Convert an image to a mode the compositor blends directly (RGB, RGBA, L or LA)"""
+    if image.mode == 'P':
+        return image.convert('RGBA')
+    if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+        return image.convert('RGB')
+    return image
+
+def resize_image(image, scale_factor=0.45, draft=True, flatten=True, quality=DEFAULT_QUALITY):
+    """Resize image by scale factor while maintaining aspect ratio"""
+    # Calculate new size based on scale factor
+    new_width = int(image.width * scale_factor)
+    new_height = int(image.height * scale_factor)
+    return resize_to(
+        image, (new_width, new_height), draft=draft and scale_factor < 1, flatten=flatten, quality=quality
+    )
+
+def resize_to(image, size, box=None, draft=True, flatten=True, quality=DEFAULT_QUALITY):
+    """Resize image, or the box region of it, to exactly size
+
+    quality is a tier from collage.resample: 'fast', 'balanced' or 'best'.
+    """
+    new_width, new_height = size
+    
+    # Decode JPEGs at a reduced scale when downscaling
+    if draft and new_width > 0 and new_height > 0:
+        source_width = box[2] - box[0] if box else image.width
+        source_height = box[3] - box[1] if box else image.height
+        # Ask for enough reduced pixels that the region still covers size
+        request = (
+            math.ceil(new_width * image.width / source_width),
+            math.ceil(new_height * image.height / source_height),
+        )
+        if request[0] < image.width and request[1] < image.height:
+            with metrics.stage('draft_decode', bytes_in=metrics.pixel_bytes(image)) as timing:
+                original_width = image.width
+                image, frame = draft_decode(image, request)
+                timing.bytes_out = metrics.pixel_bytes(image)
+            if frame is not None:
+                # The frame maps the original image onto the reduced pixels
+                ratio = frame[2] / original_width
+                box = tuple(edge * ratio for edge in box) if box else frame
+    
+    with metrics.stage('resize', bytes_in=metrics.pixel_bytes(image)) as timing:
+        # Flatten onto white now, or keep alpha for the NumPy compositor
+        image = flatten_alpha(image) if flatten else tile_mode(image)
+        
+        # Resize image maintaining aspect ratio
+        resized_image = resample(image, (new_width, new_height), box=box, quality=quality)
+        timing.bytes_out = metrics.pixel_bytes(resized_image)
+    
+    return resized_image
+
+def resize_payload(payload, scale_factor, flatten=True, quality=DEFAULT_QUALITY):
+    """Worker entry point: reopen encoded bytes and resize them"""
+    if isinstance(payload, bytes):
+        payload = Image.open(io.BytesIO(payload))
+    return resize_image(payload, scale_factor, flatten=flatten, quality=quality)
+
+def resize_tiles(images, scale_factor=0.45, executor='thread', max_workers=None, cache=None, flatten=True,
+                 progress=None, quality=DEFAULT_QUALITY):
+    """Resize images concurrently, returning tiles in input order
+
+    progress, if given, is called as progress(done, total) after each resize;
+    an exception it raises stops the remaining resizes.
+    """
+    # Resize each distinct image, and each duplicate upload, once so no two workers share a file pointer
+    unique_images = list({image_identity(img): img for img in images}.values())
+    
+    # Serve what we can from the cache and only resize the misses
+    tiles_by_id = {}
+    keys = {}
+    if cache is not None:
+        for img in unique_images:
+            keys[image_identity(img)] = tile_key(
+                img, scale_factor, background=(255, 255, 255) if flatten else None, quality=quality
+            )
+            tile = cache.get(keys[image_identity(img)])
+            if tile is not None:
+                tiles_by_id[image_identity(img)] = tile
+        unique_images = [img for img in unique_images if image_identity(img) not in tiles_by_id]
+    
+    count = len(unique_images)
+    if executor is None or count < 2:
+        tiles = (resize_image(img, scale_factor, flatten=flatten, quality=quality) for img in unique_images)
+        tiles = list(report_progress(tiles, count, progress))
+    elif executor == 'thread':
+        # Pillow releases the GIL while decoding and resampling
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                metrics.submit_in_context(pool, resize_image, img, scale_factor, True, flatten, quality)
+                for img in unique_images
+            ]
+            try:
+                tiles = list(report_progress((future.result() for future in futures), count, progress))
+            except BaseException:
+                # Don't start the resizes still queued
+                for future in futures:
+                    future.cancel()
+                raise
+    elif executor == 'process':
+        # Ship encoded bytes instead of pickling (and fully decoding) the images
+        payloads = [image_payload(img) for img in unique_images]
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            tiles = pool.map(resize_payload, payloads, [scale_factor] * count, [flatten] * count, [quality] * count)
+            tiles = list(report_progress(tiles, count, progress))
+    else:
+        raise ValueError(f"Unknown executor: {executor}")
+    
+    for img, tile in zip(unique_images, tiles):
+        tiles_by_id[image_identity(img)] = tile
+        if cache is not None:
+            cache.put(keys[image_identity(img)], tile)
+    return [tiles_by_id[image_identity(img)] for img in images]
+
+def image_identity(image):
+    """Content hash of an ingested image, else its object id; equal identities resize to equal tiles"""
+    # Hashing pixels here would cost more than the duplicate resize it saves
+    return getattr(image, 'content_digest', None) or id(image)
+
+def report_progress(tiles, total, progress):
+    """Pass tiles through, calling progress(done, total) after each"""
+    for done, tile in enumerate(tiles, 1):
+        if progress:
+            progress(done, total)
+        yield tile
+
+def count_missing_tiles(images, scale_factor=0.45, cache=None, state=None, layout=None, quality=DEFAULT_QUALITY):
+    """How many distinct tiles create_collage would still have to resize
+
+    Tiles kept in state or held by cache are not counted, so 0 means the
+    collage only has to be pasted. Takes the same images, scale_factor,
+    state, layout and quality as create_collage.
+    """
+    if layout is not None:
+        keys = {
+            tile_key(image, ((p.width, p.height), p.box), background=None, quality=quality)
+            for image, p in zip(images, layout.placements)
+        }
+    else:
+        keys = {tile_key(image, scale_factor, background=None, quality=quality) for image in images}
+    kept = state.tiles if state is not None else {}
+    return sum(1 for key in keys if key not in kept and (cache is None or key not in cache))
+
+def create_collage(images, scale_factor=0.45, cols_per_row=None, executor='thread', max_workers=None, cache=None,
+                   engine='paste', state=None, layout=None, progress=None, quality=DEFAULT_QUALITY):
+    """Create a grid collage from list of images without whitespace
+
+    With a CollageState, tiles and the canvas are kept between calls and a
+    reorder or column change only redraws what moved; the returned canvas
+    then belongs to the state and is updated in place by the next call.
+    
+    A Layout from collage.layout.compute_layout replaces the grid: each
+    image is resized once straight to its placement, and scale_factor,
+    cols_per_row, engine and state are ignored.
+    
+    progress(done, total) is called as tiles are resized; see resize_tiles.
+    quality is the resampling tier of every tile; see collage.resample.
+    """
+    if not images:
+        return None
+    with metrics.stage('collage', bytes_in=sum(metrics.pixel_bytes(img) for img in images)) as timing:
+        if layout is not None:
+            # Imported here because the layout module builds on this one
+            from .layout import render_layout
+            collage = render_layout(images, layout, executor, max_workers, cache, progress, quality)
+        elif state is None:
+            collage = build_collage(
+                images, scale_factor, cols_per_row, executor, max_workers, cache, engine, progress, quality
+            )
+        else:
+            collage = update_collage(
+                state, images, scale_factor, cols_per_row, executor, max_workers, cache, engine, progress, quality
+            )
+        timing.bytes_out = metrics.pixel_bytes(collage) if collage else 0
+    return collage
+
+def build_collage(images, scale_factor, cols_per_row, executor, max_workers, cache, engine, progress=None,
+                  quality=DEFAULT_QUALITY):
+    """Resize and composite the tiles of a non-empty image list"""
+    if engine not in ('paste', 'numpy'):
+        raise ValueError(f"Unknown engine: {engine}")
+    
+    num_images = len(images)
+    rows, cols = calculate_grid_size(num_images, cols_per_row)
+    
+    # Resize all images, in parallel unless executor is None; alpha is
+    # blended straight onto the white canvas instead of per tile
+    resized_images = resize_tiles(
+        images, scale_factor, executor, max_workers, cache, flatten=False, progress=progress, quality=quality
+    )
+    
+    # Calculate collage dimensions based on actual image sizes
+    if resized_images:
+        # Get the maximum width and height from all resized images
+        max_width = max(img.width for img in resized_images)
+        max_height = max(img.height for img in resized_images)
+        
+        if engine == 'numpy':
+            # Imported lazily so the CLI path never loads NumPy
+            from .composite import composite_tiles
+            return composite_tiles(resized_images, cols, max_width, max_height)
+        
+        return paste_tiles(resized_images, cols, max_width, max_height)
+    
+    return None
+
+def update_collage(state, images, scale_factor, cols_per_row, executor, max_workers, cache, engine, progress=None,
+                   quality=DEFAULT_QUALITY):
+    """build_collage that reuses the tiles and canvas kept in state"""
+    if engine not in ('paste', 'numpy'):
+        raise ValueError(f"Unknown engine: {engine}")
+    
+    rows, cols = calculate_grid_size(len(images), cols_per_row)
+    keys = [tile_key(img, scale_factor, background=None, quality=quality) for img in images]
+    
+    # Only images whose tiles are not kept yet are resized
+    missing = {key: img for key, img in zip(keys, images) if key not in state.tiles}
+    new_tiles = resize_tiles(
+        list(missing.values()), scale_factor, executor, max_workers, cache, flatten=False, progress=progress,
+        quality=quality
+    )
+    tiles = {key: state.tiles.get(key) for key in keys}
+    tiles.update(zip(missing, new_tiles))
+    
+    ordered = [tiles[key] for key in keys]
+    cell_size = (max(tile.width for tile in ordered), max(tile.height for tile in ordered))
+    
+    if state.can_update(keys, cols, cell_size):
+        changed = state.changed_cells(keys)
+        with metrics.stage('paste', bytes_in=sum(metrics.pixel_bytes(ordered[i]) for i in changed)):
+            for i in changed:
+                paste_cell(state.canvas, i, ordered[i], cols, *cell_size, clear=True)
+        state.last_update = ('cells', len(changed))
+    else:
+        # Kept tiles are laid out again as they are; nothing is resized unless new
+        relayout = state.canvas is not None and not missing
+        if engine == 'numpy':
+            from .composite import composite_tiles
+            state.canvas = composite_tiles(ordered, cols, *cell_size)
+        else:
+            state.canvas = paste_tiles(ordered, cols, *cell_size)
+        state.last_update = ('relayout' if relayout else 'full', len(ordered))
+    
+    state.keys, state.cols, state.cell_size, state.tiles = keys, cols, cell_size, tiles
+    return state.canvas
+
+def paste_cell(canvas, index, tile, cols, cell_width, cell_height, clear=False):
+    """Paste one tile into its row-major cell, optionally whitening the cell first"""
+    x = (index % cols) * cell_width
+    y = (index // cols) * cell_height
+    if clear:
+        canvas.paste((255, 255, 255), (x, y, x + cell_width, y + cell_height))
+    # Transparent tiles blend straight onto the white cell
+    canvas.paste(tile, (x, y), tile if tile.mode in ('RGBA', 'LA') else None)
+
+def paste_tiles(tiles, cols, cell_width, cell_height):
+    """Paste tiles row-major into a white grid of cells"""
+    rows = math.ceil(len(tiles) / cols)
+    
+    with metrics.stage('paste', bytes_in=sum(metrics.pixel_bytes(img) for img in tiles)) as timing:
+        # Create the collage without any padding
+        collage_width = cols * cell_width
+        collage_height = rows * cell_height
+        collage = Image.new('RGB', (collage_width, collage_height), (255, 255, 255))
+        
+        for i, img in enumerate(tiles):
+            paste_cell(collage, i, img, cols, cell_width, cell_height)
+        timing.bytes_out = metrics.pixel_bytes(collage)
+    
+    return collage
+
+def scaled_size(image, scale_factor):
+    """Size of an image after resizing, computed from its header alone"""
+    return int(image.width * scale_factor), int(image.height * scale_factor)
+
+def validate_image(uploaded_file):
+    """Validate if uploaded file is a valid image"""
+    with metrics.stage('validate', bytes_in=getattr(uploaded_file, 'size', 0) or 0):
+        try:
+            image = Image.open(uploaded_file)
+            # Verify it's a valid image by loading it
+            image.verify()
+            # Reset file pointer after verify
+            uploaded_file.seek(0)
+            return True, None
+        except Exception as e:
+            return False, str(e)
+
+def resize_single_image(image, scale_factor, cache=None, quality=DEFAULT_QUALITY):
+    """Resize a single image by the specified scale factor
+
+    Uses the same resampling tiers as collage tiles; see collage.resample.
+    Like tiles, lazily opened JPEGs are decoded at a reduced scale when
+    downscaling, and a cache hit decodes nothing at all.
+    """
+    if cache is not None:
+        key = tile_key(image, scale_factor, draft=scale_factor < 1, quality=quality)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        resized_image = resize_single_image(image, scale_factor, quality=quality)
+        cache.put(key, resized_image)
+        return resized_image
+    
+    with metrics.stage('resize_single', bytes_in=metrics.pixel_bytes(image)) as timing:
+        # Transparency is flattened onto white, as for collage tiles
+        resized_image = resize_image(image, scale_factor, quality=quality)
+        timing.bytes_out = metrics.pixel_bytes(resized_image)
+    
+    return resized_image
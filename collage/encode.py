@@ -0,0 +1,100 @@
+"""Output encoding with tunable formats and memoized background encoding"""
+import io
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from PIL import Image
+
+from . import metrics
+
+# Format name -> (file extension, MIME type)
+OUTPUT_FORMATS = {
+    'PNG': ('png', 'image/png'),
+    'JPEG': ('jpg', 'image/jpeg'),
+    'WEBP': ('webp', 'image/webp'),
+}
+PREVIEW_SIZE = (1600, 1600)
+
+class EncodedImage(NamedTuple):
+    data: bytes
+    format: str
+    extension: str
+    mime: str
+    seconds: float
+
+def encode_image(image, fmt='PNG', quality=90, compress_level=6, lossless=False):
+    """Encode an image to bytes, timing the encoder"""
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format: {fmt}")
+
+    if fmt == 'PNG':
+        # Lower compress_level trades file size for much faster zlib work
+        options = {'compress_level': compress_level}
+    elif fmt == 'JPEG':
+        options = {'quality': quality, 'optimize': False}
+    else:
+        options = {'quality': quality, 'lossless': lossless}
+
+    with metrics.stage('encode', bytes_in=metrics.pixel_bytes(image)) as timing:
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt, **options)
+        seconds = time.perf_counter() - start
+        timing.bytes_out = buffer.tell()
+
+    extension, mime = OUTPUT_FORMATS[fmt]
+    return EncodedImage(buffer.getvalue(), fmt, extension, mime, seconds)
+
+def encode_source(source, fmt='PNG', quality=90, compress_level=6, lossless=False):
+    """encode_image for an image or a zero-argument callable that loads one"""
+    image = source() if callable(source) else source
+    return encode_image(image, fmt, quality, compress_level, lossless)
+
+def encode_preview(image, max_size=PREVIEW_SIZE):
+    """Small display copy of an image, so the full canvas need not be kept around"""
+    preview = image.copy()
+    preview.thumbnail(max_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    buffer = io.BytesIO()
+    if preview.mode in ('RGBA', 'LA', 'P'):
+        preview.save(buffer, format='PNG')
+    else:
+        preview.convert('RGB').save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+class BackgroundEncoder:
+    """Encode images on a worker thread, memoizing results by version and options"""
+
+    def __init__(self, max_workers=2, max_entries=32):
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='collage-encode')
+        self._futures = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, version, source, fmt='PNG', quality=90, compress_level=6, lossless=False):
+        """Return a future for the encoded image, starting the encode only once per key
+
+        source is an image or a zero-argument callable returning one; a
+        callable defers decoding stored bytes to the worker, and only on a miss.
+        """
+        key = (version, fmt, quality, compress_level, lossless)
+        with self._lock:
+            future = self._futures.get(key)
+            if future is None:
+                # Stages recorded on the worker still count towards the caller's run
+                future = metrics.submit_in_context(self._pool, encode_source, source, fmt, quality, compress_level, lossless)
+                self._futures[key] = future
+                # Forget the oldest encodes; their bytes can be large
+                while len(self._futures) > self.max_entries:
+                    self._futures.popitem(last=False)
+            else:
+                self._futures.move_to_end(key)
+            return future
+
+    def forget(self, version):
+        """Drop every memoized encode of one image version"""
+        with self._lock:
+            for key in [key for key in self._futures if key[0] == version]:
+                del self._futures[key]
@@ -0,0 +1,281 @@
+"""Bounded-memory export of collages too large to hold as one canvas
+
+The layout is rendered band by band, where a band is a run of placements
+whose rows overlap, so each image is still resized exactly once. A band's
+tiles are spilled to a temporary file and read back as fixed-height
+strips, so only one tile and one strip are in memory at a time. Strips
+are written either as:
+
+* ``strips``: one PNG, encoded scanline by scanline (write_png_bands);
+* ``dzi``: a Deep Zoom pyramid of fixed-size JPEG tiles, viewable with
+  OpenSeadragon and similar viewers. Each level is built from the one
+  above it, a strip of tiles at a time.
+
+Pillow cannot write tiled TIFF, so there is no TIFF mode. choose_export
+keeps small collages on the in-memory path and picks a mode from the
+estimated canvas size.
+"""
+import io
+import math
+import os
+import shutil
+import tempfile
+import zipfile
+from typing import NamedTuple
+
+from PIL import Image
+
+from .core import resize_to
+from .resample import DEFAULT_QUALITY
+from .sources import reopen_image
+from .streaming import write_png_bands
+
+EXPORT_MODES = ('memory', 'strips', 'dzi')
+MAX_CANVAS_BYTES = int(os.environ.get('COLLAGE_MAX_CANVAS_MB', '256')) * 1024 * 1024
+# Beyond Pillow's decompression-bomb error threshold a single PNG can't be reopened by most tools
+MAX_STRIP_PIXELS = 2 * Image.MAX_IMAGE_PIXELS
+DZI_TILE_SIZE = 256
+# Rows assembled at a time; a strip of the widest canvas still fits comfortably in memory
+STRIP_HEIGHT = 256
+PREVIEW_SIZE = (1600, 1600)
+
+class ExportResult(NamedTuple):
+    mode: str
+    path: str
+    mime: str
+    size: tuple
+    preview: bytes
+
+    def as_stored(self):
+        """The form the app keeps in session state: a preview plus where the file is"""
+        return {
+            'preview': self.preview,
+            'size': self.size,
+            'export': {'mode': self.mode, 'path': self.path, 'mime': self.mime},
+        }
+
+def estimate_canvas_bytes(layout):
+    """Decoded RGB size of a layout's canvas"""
+    return layout.width * layout.height * 3
+
+def choose_export(layout, max_canvas_bytes=MAX_CANVAS_BYTES, max_strip_pixels=MAX_STRIP_PIXELS):
+    """'memory' while the canvas fits the budget, then 'strips', then 'dzi'"""
+    if estimate_canvas_bytes(layout) <= max_canvas_bytes:
+        return 'memory'
+    if layout.width * layout.height <= max_strip_pixels:
+        return 'strips'
+    return 'dzi'
+
+def layout_bands(layout):
+    """(top, bottom, placement indices) of runs of vertically overlapping placements"""
+    order = sorted(range(len(layout.placements)), key=lambda i: layout.placements[i].y)
+    bands = []
+    for i in order:
+        placement = layout.placements[i]
+        bottom = placement.y + placement.height
+        if bands and placement.y < bands[-1][1]:
+            top, band_bottom, indices = bands[-1]
+            bands[-1] = (top, max(band_bottom, bottom), indices + [i])
+        else:
+            bands.append((placement.y, bottom, [i]))
+    return bands
+
+def iter_layout_bands(images, layout, strip_height=STRIP_HEIGHT, progress=None, quality=DEFAULT_QUALITY):
+    """Yield (top, RGB strip) pairs of at most strip_height rows covering the whole canvas
+
+    Each band's tiles are resized one at a time and spilled to a temporary
+    file, then the strips are assembled from row slices of them, so memory
+    stays at one tile plus one strip however large the canvas is.
+    progress(done, total) is called after each tile is resized.
+    """
+    done = 0
+    y = 0
+    for top, bottom, indices in layout_bands(layout):
+        if top > y:
+            yield from white_strips(layout.width, y, top, strip_height)
+        with tempfile.TemporaryFile() as spool:
+            spilled = []
+            for i in indices:
+                placement = layout.placements[i]
+                # A fresh decoder each time, so no decoded pixels stay cached on the source image
+                tile = resize_to(
+                    reopen_image(images[i]), (placement.width, placement.height), box=placement.box, flatten=False,
+                    quality=quality
+                )
+                spilled.append((placement, tile.mode, spool.tell()))
+                spool.write(tile.tobytes())
+                del tile
+                done += 1
+                if progress:
+                    progress(done, len(images))
+            spool.flush()
+            for strip_top in range(top, bottom, strip_height):
+                strip_bottom = min(strip_top + strip_height, bottom)
+                strip = Image.new('RGB', (layout.width, strip_bottom - strip_top), (255, 255, 255))
+                for placement, mode, offset in spilled:
+                    first = max(strip_top, placement.y) - placement.y
+                    last = min(strip_bottom, placement.y + placement.height) - placement.y
+                    if first >= last:
+                        continue
+                    row_bytes = placement.width * Image.getmodebands(mode)
+                    # Read just these rows back; mapping the spool would count it all as resident
+                    spool.seek(offset + first * row_bytes)
+                    data = spool.read((last - first) * row_bytes)
+                    rows = Image.frombytes(mode, (placement.width, last - first), data)
+                    strip.paste(rows, (placement.x, placement.y + first - strip_top), rows if mode in ('RGBA', 'LA') else None)
+                yield strip_top, strip
+        y = bottom
+    if y < layout.height:
+        yield from white_strips(layout.width, y, layout.height, strip_height)
+
+def white_strips(width, top, bottom, strip_height=STRIP_HEIGHT):
+    """Blank strips for canvas rows no placement covers"""
+    for strip_top in range(top, bottom, strip_height):
+        yield strip_top, Image.new('RGB', (width, min(strip_height, bottom - strip_top)), (255, 255, 255))
+
+class PreviewBuilder:
+    """Downscaled copy of the canvas, assembled from its bands"""
+
+    def __init__(self, width, height, max_size=PREVIEW_SIZE):
+        self.scale = min(1.0, max_size[0] / width, max_size[1] / height)
+        self.image = Image.new('RGB', (max(1, round(width * self.scale)), max(1, round(height * self.scale))), (255, 255, 255))
+
+    def add(self, top, band):
+        y = round(top * self.scale)
+        height = round((top + band.height) * self.scale) - y
+        if height > 0:
+            self.image.paste(band.resize((self.image.width, height), Image.Resampling.BOX), (0, y))
+
+    def encode(self):
+        buffer = io.BytesIO()
+        self.image.save(buffer, format='JPEG', quality=85)
+        return buffer.getvalue()
+
+class PyramidWriter:
+    """Write a Deep Zoom tile pyramid from full-resolution strips fed top to bottom
+
+    Each level keeps at most one strip of tiles pending; every finished
+    strip is cut into tiles and halved into the level below.
+    """
+
+    def __init__(self, width, height, write, tile_size=DZI_TILE_SIZE, fmt='jpg', quality=85):
+        self.width = width
+        self.height = height
+        self.write = write
+        self.tile_size = tile_size
+        self.fmt = fmt
+        self.quality = quality
+        self.max_level = max(0, math.ceil(math.log2(max(width, height))))
+        self.pending = {}
+        self.tile_rows = {}
+
+    def descriptor(self):
+        """The .dzi XML describing the pyramid"""
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{self.fmt}" '
+            f'Overlap="0" TileSize="{self.tile_size}">\n'
+            f'  <Size Width="{self.width}" Height="{self.height}"/>\n'
+            '</Image>\n'
+        )
+
+    def add(self, strip):
+        self._feed(self.max_level, strip)
+
+    def close(self):
+        """Flush the partial strip of every level, top level first"""
+        for level in range(self.max_level, -1, -1):
+            strip = self.pending.pop(level, None)
+            if strip is not None:
+                self._emit(level, strip)
+
+    def _feed(self, level, strip):
+        pending = self.pending.pop(level, None)
+        if pending is not None:
+            joined = Image.new('RGB', (strip.width, pending.height + strip.height))
+            joined.paste(pending, (0, 0))
+            joined.paste(strip, (0, pending.height))
+            strip = joined
+        # Tile strips are an even number of rows, so halving them never drifts
+        top = 0
+        while strip.height - top >= self.tile_size:
+            self._emit(level, strip.crop((0, top, strip.width, top + self.tile_size)))
+            top += self.tile_size
+        if top < strip.height:
+            self.pending[level] = strip.crop((0, top, strip.width, strip.height))
+
+    def _emit(self, level, strip):
+        row = self.tile_rows.get(level, 0)
+        self.tile_rows[level] = row + 1
+        for col, x in enumerate(range(0, strip.width, self.tile_size)):
+            tile = strip.crop((x, 0, min(x + self.tile_size, strip.width), strip.height))
+            buffer = io.BytesIO()
+            tile.save(buffer, format='JPEG' if self.fmt == 'jpg' else self.fmt.upper(), quality=self.quality)
+            self.write(f"{level}/{col}_{row}.{self.fmt}", buffer.getvalue())
+        if level > 0:
+            self._feed(level - 1, strip.reduce(2))
+
+def write_png_layout(output, images, layout, compress_level=6, preview=None, progress=None,
+                     quality=DEFAULT_QUALITY):
+    """Encode a layout as one PNG, one strip at a time"""
+    def bands():
+        for top, band in iter_layout_bands(images, layout, progress=progress, quality=quality):
+            if preview is not None:
+                preview.add(top, band)
+            yield band
+    write_png_bands(output, layout.width, layout.height, bands(), compress_level)
+
+def write_dzi(images, layout, write, tile_size=DZI_TILE_SIZE, preview=None, progress=None, name='collage',
+              quality=DEFAULT_QUALITY):
+    """Write a layout as a Deep Zoom pyramid through write(relative path, bytes)
+
+    Tiles go to ``<name>_files/<level>/<col>_<row>.jpg`` next to ``<name>.dzi``.
+    """
+    pyramid = PyramidWriter(
+        layout.width, layout.height, lambda path, data: write(f"{name}_files/{path}", data), tile_size
+    )
+    for top, band in iter_layout_bands(images, layout, progress=progress, quality=quality):
+        if preview is not None:
+            preview.add(top, band)
+        pyramid.add(band)
+    pyramid.close()
+    write(f"{name}.dzi", pyramid.descriptor().encode())
+
+def export_collage(images, layout, directory, mode=None, progress=None, quality=DEFAULT_QUALITY):
+    """Export a layout too large for memory into directory, returning an ExportResult
+
+    'strips' writes collage.png; 'dzi' writes collage.zip holding the
+    descriptor and its tiles. mode defaults to choose_export's pick.
+    """
+    mode = mode or choose_export(layout)
+    if mode not in ('strips', 'dzi'):
+        raise ValueError(f"Unknown export mode: {mode}")
+    os.makedirs(directory, exist_ok=True)
+    preview = PreviewBuilder(layout.width, layout.height)
+
+    if mode == 'strips':
+        path = os.path.join(directory, 'collage.png')
+        with open(path, 'wb') as output:
+            write_png_layout(
+                output, images, layout, compress_level=1, preview=preview, progress=progress, quality=quality
+            )
+        mime = 'image/png'
+    else:
+        path = os.path.join(directory, 'collage.zip')
+        # JPEG tiles are already compressed, so members are stored as is
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+            write_dzi(images, layout, archive.writestr, preview=preview, progress=progress, quality=quality)
+        mime = 'application/zip'
+    return ExportResult(mode, path, mime, (layout.width, layout.height), preview.encode())
+
+def link_export(path, directory):
+    """Hard-link an exported file into directory, copying it where links are unsupported; return the new path
+
+    The file then lives until both its original and the link are deleted.
+    """
+    target = os.path.join(directory, os.path.basename(path))
+    try:
+        os.link(path, target)
+    except OSError:
+        shutil.copyfile(path, target)
+    return target
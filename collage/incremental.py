@@ -0,0 +1,43 @@
+"""State kept between collages so reorders and column changes skip the resize work"""
+
+class CollageState:
+    """Layout, tile placements and canvas of the last collage built with this state
+
+    Pass the same state to successive create_collage calls. When the tiles,
+    their cell size and the column count are unchanged, only the cells whose
+    tile moved are re-blitted onto the previous canvas, which is updated in
+    place. When only the column count changes the kept tiles are laid out
+    again without being resized.
+    """
+
+    def __init__(self):
+        self.canvas = None
+        self.keys = []
+        self.cols = None
+        self.cell_size = None
+        self.tiles = {}
+        # ('full' | 'relayout' | 'cells', number of cells drawn) for the last update
+        self.last_update = None
+
+    def changed_cells(self, keys):
+        """Indices of cells whose tile differs from the previous collage"""
+        return [i for i, (old, new) in enumerate(zip(self.keys, keys)) if old != new]
+
+    def can_update(self, keys, cols, cell_size):
+        """Whether the previous canvas can be patched instead of rebuilt"""
+        return (
+            self.canvas is not None
+            and len(keys) == len(self.keys)
+            and cols == self.cols
+            and cell_size == self.cell_size
+        )
+
+    def nbytes(self):
+        """Decoded bytes held by the kept canvas and tiles"""
+        images = list(self.tiles.values())
+        if self.canvas is not None:
+            images.append(self.canvas)
+        return sum(image.width * image.height * len(image.getbands()) for image in images)
+
+    def clear(self):
+        self.__init__()
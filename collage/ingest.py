@@ -0,0 +1,107 @@
+"""Single-pass ingest of uploads into compact metadata records"""
+import io
+from typing import NamedTuple
+
+from PIL import Image
+
+from . import metrics
+from .archive import is_zip_name, iter_zip_images
+from .sources import hash_bytes
+
+EXIF_ORIENTATION = 0x0112
+THUMBNAIL_SIZE = (150, 150)
+
+class ImageRecord(NamedTuple):
+    name: str
+    digest: str
+    byte_size: int
+    format: str
+    mode: str
+    width: int
+    height: int
+    orientation: int
+    data: bytes
+    thumbnail: bytes
+
+def exif_orientation(image):
+    """EXIF orientation from the already-parsed header, without decoding pixels"""
+    # PNG getexif() would decode the whole image to look past IDAT
+    if image.format == 'PNG' and 'exif' not in image.info:
+        return 1
+    return image.getexif().get(EXIF_ORIENTATION, 1)
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE):
+    """Encode a small preview from a fresh, reduced-scale decode of the image"""
+    image = Image.open(io.BytesIO(data))
+    # thumbnail() decodes JPEGs in draft mode and uses reduce() before the final resample
+    image.thumbnail(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+
+    buffer = io.BytesIO()
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image.save(buffer, format='PNG')
+    else:
+        image.convert('RGB').save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+def read_bytes(fileobj):
+    """All bytes of an upload or archive member"""
+    if hasattr(fileobj, 'getvalue'):
+        return fileobj.getvalue()
+    fileobj.seek(0)
+    return fileobj.read()
+
+def ingest_bytes(name, data, known=None):
+    """Parse an image header once, returning (record, error)
+
+    known maps content hashes to records already ingested, such as a dict
+    or a collage.store.UploadStore; matching files are returned from it
+    without being parsed again, and share its bytes.
+    """
+    digest = hash_bytes(data)
+    existing = known.get(digest) if known is not None else None
+    if existing is not None:
+        return existing._replace(name=name), None
+
+    try:
+        with metrics.stage('ingest', bytes_in=len(data)) as timing:
+            # Image.open only reads the header; pixels are decoded later, at most once per tile
+            image = Image.open(io.BytesIO(data))
+            orientation = exif_orientation(image)
+            thumbnail = make_thumbnail(data)
+            timing.bytes_out = len(thumbnail)
+    except Exception as e:
+        return None, str(e)
+
+    record = ImageRecord(
+        name, digest, len(data), image.format, image.mode,
+        image.width, image.height, orientation, data, thumbnail
+    )
+    if known is not None:
+        # Another thread may have ingested the same bytes meanwhile; keep the first copy
+        record = known.setdefault(digest, record)._replace(name=name)
+    return record, None
+
+def open_record(record):
+    """Lazily open a record's bytes; nothing is decoded until pixels are needed"""
+    image = Image.open(io.BytesIO(record.data))
+    image.content_digest = record.digest
+    return image
+
+def ingest_upload(uploaded_file, known=None):
+    """Ingest one upload, expanding ZIP archives, into (records, errors)"""
+    records, errors = [], []
+    if is_zip_name(uploaded_file.name):
+        members = ((f"{uploaded_file.name}/{name}", member) for name, member in iter_zip_images(uploaded_file))
+    else:
+        members = [(uploaded_file.name, uploaded_file)]
+
+    try:
+        for name, member in members:
+            record, error = ingest_bytes(name, read_bytes(member), known)
+            if error:
+                errors.append(f"{name}: {error}")
+            else:
+                records.append(record)
+    except Exception as e:
+        errors.append(f"{uploaded_file.name}: {str(e)}")
+    return records, errors
@@ -0,0 +1,336 @@
+"""Background collage and batch-resize jobs on a local process pool
+
+A JobQueue runs jobs in worker processes, so a long render never holds up
+the caller (for the app, a session's script thread) and the number of
+concurrent renders per host is capped by the pool size. Workers report
+progress over a queue, which the caller polls through ``get``. Jobs are
+cancelled through a shared flag that workers check at every progress
+report. Finished results are kept by job id, and resubmitting a job with
+the same key returns the existing job instead of rendering it again.
+While metrics are enabled, each job runs inside a metrics run in its
+worker, and the run comes back as ``Job.run`` with its stages counted in
+the caller's totals.
+A worker that dies (killed for running out of memory, say) fails the jobs
+it took down, and the pool is replaced on the next submit.
+
+Set ``COLLAGE_JOB_WORKERS`` to change the per-host concurrency limit.
+"""
+import io
+import itertools
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+
+from . import metrics
+from .archive import batch_resize_to_zip, is_zip_name, iter_zip_images
+from .cache import TileCache
+from .core import create_collage
+from .encode import encode_image, encode_preview
+from .export import export_collage
+from .layout import compute_layout, image_sizes
+from .memory import pool_decode_buffers
+from .resample import DEFAULT_QUALITY
+from .streaming import stream_collage
+
+MAX_WORKERS = int(os.environ.get('COLLAGE_JOB_WORKERS', '0')) or max(1, (os.cpu_count() or 2) // 2)
+# Cancellation flags are shared memory; job slots wrap around this many entries
+CANCEL_SLOTS = 4096
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+class JobCancelled(Exception):
+    """Raised in a worker when its job has been cancelled"""
+
+class Job:
+    """Status, progress and result of one submitted job"""
+
+    def __init__(self, job_id, kind, key, slot):
+        self.job_id = job_id
+        self.kind = kind
+        self.key = key
+        self.slot = slot
+        self.status = QUEUED
+        self.done = 0
+        # 0 while the amount of work is not known yet
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.finished = None
+        self.future = None
+        # The worker's metrics.Run, when metrics were enabled at submit
+        self.run = None
+
+    @property
+    def fraction(self):
+        """Progress between 0 and 1, for progress bars"""
+        if self.status == DONE:
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+# Set in each worker process by the pool initializer
+_progress_queue = None
+_cancel_flags = None
+
+def _init_worker(progress_queue, cancel_flags):
+    global _progress_queue, _cancel_flags
+    _progress_queue = progress_queue
+    _cancel_flags = cancel_flags
+    # Stages are returned with each result and written out by the caller, not by every worker
+    metrics.set_metrics_file(None)
+    # Successive renders on this worker reuse the pixel blocks of the last
+    pool_decode_buffers()
+
+class JobContext:
+    """Worker-side handle through which a job reports progress and learns it was cancelled"""
+
+    def __init__(self, job_id, slot):
+        self.job_id = job_id
+        self.slot = slot
+
+    def report(self, done, total=0):
+        if _cancel_flags is not None and _cancel_flags[self.slot]:
+            raise JobCancelled()
+        if _progress_queue is not None:
+            _progress_queue.put((self.job_id, done, total))
+
+def collage_job(spec, context):
+    """Render a collage from encoded images, returning its PNG bytes, a preview and its size
+
+    spec holds ``images`` (encoded bytes), ``scale``, ``cols``,
+    ``low_memory``, ``quality`` and optionally ``layout``, keyword arguments
+    for collage.layout.compute_layout. With ``export`` ('strips' or 'dzi') the
+    collage is written to a temporary directory instead, and the result
+    holds the file's path in place of PNG bytes.
+
+    With a ``tile_budget`` in bytes, the result also holds ``tiles``, the
+    resized (tile key, tile) pairs that fit the budget, so the caller can
+    seed its own TileCache and redraw later reorders without a job.
+    """
+    images = [Image.open(io.BytesIO(data)) for data in spec['images']]
+    scale_factor, cols_per_row = spec['scale'], spec.get('cols')
+    layout_options = spec.get('layout')
+    quality = spec.get('quality', DEFAULT_QUALITY)
+    # Keys match the caller's, since both hash the same encoded bytes
+    cache = TileCache(spec['tile_budget']) if spec.get('tile_budget') else None
+
+    if spec.get('export'):
+        layout = compute_layout(
+            image_sizes(images), scale_factor=scale_factor, cols_per_row=cols_per_row, **(layout_options or {})
+        )
+        directory = tempfile.mkdtemp(prefix='collage-export-')
+        try:
+            exported = export_collage(
+                images, layout, directory, spec['export'], progress=context.report, quality=quality
+            )
+        except BaseException:
+            # Failed and cancelled exports leave nothing behind
+            shutil.rmtree(directory, ignore_errors=True)
+            raise
+        return exported.as_stored()
+    if layout_options:
+        layout = compute_layout(image_sizes(images), scale_factor=scale_factor, cols_per_row=cols_per_row, **layout_options)
+        collage = create_collage(images, layout=layout, cache=cache, progress=context.report, quality=quality)
+    elif spec.get('low_memory'):
+        context.report(0, len(images))
+        collage = stream_collage(images, scale_factor, cols_per_row, quality=quality)
+    else:
+        collage = create_collage(
+            images, scale_factor, cols_per_row, cache=cache, progress=context.report, quality=quality
+        )
+    del images
+
+    # Checked once more so a cancel during the paste skips the encode
+    context.report(len(spec['images']), len(spec['images']))
+    return {
+        'png': encode_image(collage, 'PNG', compress_level=1).data,
+        'preview': encode_preview(collage),
+        'size': collage.size,
+        'tiles': cache.items() if cache is not None else [],
+    }
+
+def iter_sources(files):
+    """Yield (name, file-like) for (name, bytes) pairs, expanding ZIP archives"""
+    for name, data in files:
+        if is_zip_name(name):
+            for member_name, member in iter_zip_images(io.BytesIO(data)):
+                yield f"{name}/{member_name}", member
+        else:
+            yield name, io.BytesIO(data)
+
+def batch_resize_job(spec, context):
+    """Resize ``files`` ((name, bytes) pairs) by ``scale`` into a ZIP of ``format`` images at ``quality``"""
+    output = io.BytesIO()
+    errors = batch_resize_to_zip(
+        iter_sources(spec['files']), spec['scale'], output, fmt=spec.get('format', 'PNG'),
+        progress=lambda done, name: context.report(done), quality=spec.get('quality', DEFAULT_QUALITY)
+    )
+    return {'zip': output.getvalue(), 'errors': errors}
+
+JOB_KINDS = {
+    'collage': collage_job,
+    'batch_resize': batch_resize_job,
+}
+
+def run_job(kind, job_id, slot, spec):
+    """Worker entry point"""
+    context = JobContext(job_id, slot)
+    # The first report marks the job as running, or stops it if cancelled while queued
+    context.report(0)
+    # Spawned workers don't see the caller's metrics.enable(), so the flag comes with the spec
+    metrics.enable(spec.get('metrics', False))
+    if not metrics.is_enabled():
+        return JOB_KINDS[kind](spec, context)
+    with metrics.run(kind) as job_run:
+        result = JOB_KINDS[kind](spec, context)
+    result['metrics'] = metrics.export_run(job_run)
+    return result
+
+class JobQueue:
+    """Process-pool job runner with polling, cancellation and results kept by job id"""
+
+    def __init__(self, max_workers=MAX_WORKERS, max_jobs=32):
+        self.max_workers = max_workers
+        self.max_jobs = max_jobs
+        # Spawned workers don't inherit the locks held by the caller's other threads
+        self._context = multiprocessing.get_context('spawn')
+        self._progress = self._context.Queue()
+        self._cancel_flags = self._context.RawArray('b', CANCEL_SLOTS)
+        self._pool = self._new_pool()
+        self._jobs = OrderedDict()
+        self._by_key = {}
+        self._slots = itertools.count()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._drain_progress, name='collage-jobs', daemon=True).start()
+
+    def submit(self, kind, spec, key=None):
+        """Queue a job and return its id; a live or finished job with the same key is reused"""
+        if kind not in JOB_KINDS:
+            raise ValueError(f"Unknown job kind: {kind}")
+        with self._lock:
+            existing = self._jobs.get(self._by_key.get(key)) if key is not None else None
+            if existing is not None and existing.status not in (FAILED, CANCELLED):
+                self._jobs.move_to_end(existing.job_id)
+                return existing.job_id
+
+            spec = {**spec, 'metrics': metrics.is_enabled()}
+            job = Job(uuid.uuid4().hex, kind, key, next(self._slots) % CANCEL_SLOTS)
+            self._cancel_flags[job.slot] = 0
+            self._jobs[job.job_id] = job
+            if key is not None:
+                self._by_key[key] = job.job_id
+            self._evict()
+
+        try:
+            job.future = self._submit(run_job, kind, job.job_id, job.slot, spec)
+        except Exception as e:
+            # The job never reached a worker; failing it reports the error and frees its key for a retry
+            with self._lock:
+                job.error, job.status = str(e) or type(e).__name__, FAILED
+                job.finished = time.time()
+            return job.job_id
+        job.future.add_done_callback(lambda future: self._finish(job, future))
+        return job.job_id
+
+    def get(self, job_id):
+        """The Job for job_id, or None once it has been evicted"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """Cancel a queued job outright, or ask a running one to stop at its next progress report"""
+        job = self.get(job_id)
+        if job is None or job.status in FINISHED:
+            return False
+        self._cancel_flags[job.slot] = 1
+        # A queued future is cancelled outright; its done callback marks the job, so no lock is held here
+        if job.future is not None:
+            job.future.cancel()
+        return True
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
+
+    def shutdown(self):
+        self._pool.shutdown(cancel_futures=True)
+        self._progress.put(None)
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers, mp_context=self._context,
+            initializer=_init_worker, initargs=(self._progress, self._cancel_flags)
+        )
+
+    def _submit(self, *args):
+        """Submit to the pool, replacing it first if a dead worker has broken it"""
+        pool = self._pool
+        try:
+            return pool.submit(*args)
+        except BrokenProcessPool:
+            with self._lock:
+                # Another thread may have replaced it already
+                if self._pool is pool:
+                    self._pool = self._new_pool()
+                replacement = self._pool
+            pool.shutdown(wait=False, cancel_futures=True)
+            return replacement.submit(*args)
+
+    def _finish(self, job, future):
+        result, error = None, None
+        run = None
+        try:
+            result = future.result()
+            status = DONE
+            if 'metrics' in result:
+                run = metrics.adopt_run(result.pop('metrics'))
+        except (CancelledError, JobCancelled):
+            status = CANCELLED
+        except Exception as e:
+            error = str(e)
+            status = FAILED
+        # Under the lock, so a late progress message can't mark a finished job as running again
+        with self._lock:
+            job.result, job.error, job.status, job.run = result, error, status, run
+            job.finished = time.time()
+
+    def _drain_progress(self):
+        while True:
+            message = self._progress.get()
+            if message is None:
+                return
+            job_id, done, total = message
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or job.status in FINISHED:
+                    continue
+                job.status = RUNNING
+                job.done = done
+                job.total = total or job.total
+
+    def _evict(self):
+        """Forget the oldest finished jobs beyond max_jobs; their results can be large"""
+        excess = len(self._jobs) - self.max_jobs
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.status in FINISHED][:max(excess, 0)]:
+            job = self._jobs.pop(job_id)
+            if self._by_key.get(job.key) == job_id:
+                del self._by_key[job.key]
+            # Sessions that showed this export hold their own links to the file
+            exported = (job.result or {}).get('export')
+            if exported:
+                shutil.rmtree(os.path.dirname(exported['path']), ignore_errors=True)
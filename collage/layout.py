@@ -0,0 +1,234 @@
+"""Collage geometry computed from image headers before any pixels are decoded
+
+A layout places every image at its final size, so each tile is resized
+once, straight from the source (or a crop box of it), and the canvas only
+grows with the pixels actually shown:
+
+* ``grid``: the original layout, every cell as large as the largest tile;
+* ``fit``: fixed cells, each image scaled to fit inside its cell;
+* ``fill``: fixed cells, each image stretched to the cell;
+* ``crop``: fixed cells, each image scaled to cover its cell and centre-cropped;
+* ``justified``: rows of equal height, scaled so every row spans the canvas.
+"""
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional, Tuple
+
+from PIL import Image
+
+from . import metrics
+from .cache import tile_key
+from .core import calculate_grid_size, image_identity, report_progress, resize_to
+from .resample import DEFAULT_QUALITY
+
+LAYOUT_MODES = ('grid', 'fit', 'fill', 'crop', 'justified')
+
+class Placement(NamedTuple):
+    x: int
+    y: int
+    width: int
+    height: int
+    # Source region resized into the placement; None for the whole image
+    box: Optional[Tuple[float, float, float, float]] = None
+
+class Layout(NamedTuple):
+    width: int
+    height: int
+    placements: list
+
+def image_sizes(images):
+    """(width, height) of each image or ImageRecord, from its header"""
+    return [(image.width, image.height) for image in images]
+
+def median(values):
+    """Middle value; statistics.median would slow the CLI's cold import"""
+    values = sorted(values)
+    return values[len(values) // 2]
+
+def default_cell_size(sizes, scale_factor=0.45):
+    """Median scaled size, so one outlier cannot inflate every cell"""
+    return (
+        max(1, int(median(width for width, _ in sizes) * scale_factor)),
+        max(1, int(median(height for _, height in sizes) * scale_factor)),
+    )
+
+def grid_layout(sizes, scale_factor=0.45, cols_per_row=None):
+    """The original grid: cells of the largest scaled width and height"""
+    rows, cols = calculate_grid_size(len(sizes), cols_per_row)
+    scaled = [(int(width * scale_factor), int(height * scale_factor)) for width, height in sizes]
+    cell_width = max(width for width, _ in scaled)
+    cell_height = max(height for _, height in scaled)
+    placements = [
+        Placement((i % cols) * cell_width, (i // cols) * cell_height, width, height)
+        for i, (width, height) in enumerate(scaled)
+    ]
+    return Layout(cols * cell_width, rows * cell_height, placements)
+
+def cell_layout(sizes, cell_size, cols_per_row=None, mode='fit'):
+    """Fixed cells of cell_size, filled according to mode (fit, fill or crop)"""
+    rows, cols = calculate_grid_size(len(sizes), cols_per_row)
+    cell_width, cell_height = cell_size
+    placements = []
+    for i, (width, height) in enumerate(sizes):
+        x = (i % cols) * cell_width
+        y = (i // cols) * cell_height
+        if mode == 'fill':
+            placements.append(Placement(x, y, cell_width, cell_height))
+        elif mode == 'fit':
+            scale = min(cell_width / width, cell_height / height)
+            tile_width = max(1, round(width * scale))
+            tile_height = max(1, round(height * scale))
+            # Centre the tile in its cell
+            placements.append(Placement(
+                x + (cell_width - tile_width) // 2, y + (cell_height - tile_height) // 2, tile_width, tile_height
+            ))
+        elif mode == 'crop':
+            # The largest centred source region with the cell's aspect ratio
+            # Sized from the side that spans the whole image, so rounding cannot push it outside
+            if cell_width * height >= cell_height * width:
+                box_width, box_height = width, min(height, cell_height * width / cell_width)
+            else:
+                box_width, box_height = min(width, cell_width * height / cell_height), height
+            left = (width - box_width) / 2
+            top = (height - box_height) / 2
+            placements.append(Placement(x, y, cell_width, cell_height, (left, top, width - left, height - top)))
+        else:
+            raise ValueError(f"Unknown cell mode: {mode}")
+    return Layout(cols * cell_width, rows * cell_height, placements)
+
+def justified_layout(sizes, row_height, width=None):
+    """Rows of whole images scaled to a common height so each row spans width
+
+    Rows are filled until they reach width at row_height, then shrunk to
+    fit exactly. The last row keeps row_height rather than being stretched.
+    width defaults to the side of a square holding every image at row_height.
+    """
+    aspects = [image_width / image_height for image_width, image_height in sizes]
+    if width is None:
+        width = max(1, round(math.sqrt(sum(aspect * row_height * row_height for aspect in aspects))))
+
+    rows = []
+    current = []
+    current_aspect = 0.0
+    for i, aspect in enumerate(aspects):
+        current.append(i)
+        current_aspect += aspect
+        if current_aspect * row_height >= width:
+            rows.append((current, True))
+            current = []
+            current_aspect = 0.0
+    if current:
+        rows.append((current, False))
+
+    placements = [None] * len(sizes)
+    y = 0
+    for indices, full in rows:
+        total_aspect = sum(aspects[i] for i in indices)
+        height = max(1, round(width / total_aspect)) if full else row_height
+        # Accumulate the exact edges so rounding never leaves a gap at the right
+        x_exact = 0.0
+        for i in indices:
+            x = round(x_exact)
+            x_exact += aspects[i] * height
+            right = width if full and i == indices[-1] else round(x_exact)
+            placements[i] = Placement(x, y, max(1, right - x), height)
+        y += height
+    canvas_width = width if any(full for _, full in rows) else max(p.x + p.width for p in placements)
+    return Layout(canvas_width, y, placements)
+
+def bound_layout(layout, max_pixels):
+    """Uniformly shrink a layout whose canvas would exceed max_pixels"""
+    if not max_pixels or layout.width * layout.height <= max_pixels:
+        return layout
+    scale = math.sqrt(max_pixels / (layout.width * layout.height))
+    placements = []
+    for placement in layout.placements:
+        x = math.floor(placement.x * scale)
+        y = math.floor(placement.y * scale)
+        right = math.floor((placement.x + placement.width) * scale)
+        bottom = math.floor((placement.y + placement.height) * scale)
+        placements.append(placement._replace(x=x, y=y, width=max(1, right - x), height=max(1, bottom - y)))
+    return Layout(
+        max(1, math.floor(layout.width * scale)), max(1, math.floor(layout.height * scale)), placements
+    )
+
+def compute_layout(sizes, mode='grid', scale_factor=0.45, cols_per_row=None, cell_size=None, row_height=None,
+                   width=None, max_pixels=None):
+    """Geometry for a collage of images with the given sizes
+
+    cell_size defaults to the median scaled size for fit/fill/crop, and
+    row_height to the median scaled height for justified rows. The canvas
+    is then bounded to max_pixels, if given.
+    """
+    if not sizes:
+        return Layout(0, 0, [])
+    if mode == 'grid':
+        layout = grid_layout(sizes, scale_factor, cols_per_row)
+    elif mode in ('fit', 'fill', 'crop'):
+        layout = cell_layout(sizes, cell_size or default_cell_size(sizes, scale_factor), cols_per_row, mode)
+    elif mode == 'justified':
+        layout = justified_layout(sizes, row_height or default_cell_size(sizes, scale_factor)[1], width)
+    else:
+        raise ValueError(f"Unknown layout mode: {mode}")
+    return bound_layout(layout, max_pixels)
+
+def render_tiles(image, placements, quality=DEFAULT_QUALITY):
+    """Resize an image, or crop boxes of it, straight to each of its placements"""
+    # Duplicate uploads in fixed cells share a placement size, so each size is resized once
+    tiles = {}
+    for p in placements:
+        if (p.width, p.height, p.box) not in tiles:
+            tiles[p.width, p.height, p.box] = resize_to(
+                image, (p.width, p.height), box=p.box, flatten=False, quality=quality
+            )
+    return [tiles[p.width, p.height, p.box] for p in placements]
+
+def render_layout(images, layout, executor='thread', max_workers=None, cache=None, progress=None,
+                  quality=DEFAULT_QUALITY):
+    """Resize every image once to its placement and paste it onto a white canvas"""
+    tiles = [None] * len(images)
+    keys = {}
+    if cache is not None:
+        for i, (image, placement) in enumerate(zip(images, layout.placements)):
+            keys[i] = tile_key(
+                image, ((placement.width, placement.height), placement.box), background=None, quality=quality
+            )
+            tiles[i] = cache.get(keys[i])
+
+    # Group the misses by image, duplicate uploads included, so no two workers share a file pointer
+    groups = {}
+    for i, tile in enumerate(tiles):
+        if tile is None:
+            groups.setdefault(image_identity(images[i]), []).append(i)
+    jobs = [(images[indices[0]], [layout.placements[i] for i in indices]) for indices in groups.values()]
+
+    if executor is None or len(jobs) < 2:
+        results = (render_tiles(image, placements, quality) for image, placements in jobs)
+        results = list(report_progress(results, len(jobs), progress))
+    elif executor == 'thread':
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [
+                metrics.submit_in_context(pool, render_tiles, image, placements, quality) for image, placements in jobs
+            ]
+            try:
+                results = list(report_progress((future.result() for future in futures), len(jobs), progress))
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+    else:
+        raise ValueError(f"Unknown executor: {executor}")
+
+    for indices, group_tiles in zip(groups.values(), results):
+        for i, tile in zip(indices, group_tiles):
+            tiles[i] = tile
+            if cache is not None:
+                cache.put(keys[i], tile)
+
+    with metrics.stage('paste', bytes_in=sum(metrics.pixel_bytes(tile) for tile in tiles)) as timing:
+        canvas = Image.new('RGB', (layout.width, layout.height), (255, 255, 255))
+        for tile, placement in zip(tiles, layout.placements):
+            # Transparent tiles blend straight onto the white canvas
+            canvas.paste(tile, (placement.x, placement.y), tile if tile.mode in ('RGBA', 'LA') else None)
+        timing.bytes_out = metrics.pixel_bytes(canvas)
+    return canvas
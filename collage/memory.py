@@ -0,0 +1,48 @@
+"""Pooled decode buffers and per-session memory accounting
+
+Sessions keep only compressed bytes, ImageRecords and encoded results;
+full-resolution pixels are decoded on demand and dropped once resized.
+record_bytes and session_usage total what a session holds so it can be
+capped.
+
+Decoded pixels live in Pillow's block arena. By default every freed block
+goes straight back to the allocator, so each decode of a large image maps
+and faults in fresh memory. pool_decode_buffers has the arena keep freed
+blocks instead, up to a byte budget, and the next decode, conversion or
+resize in the process reuses them. It is per process: the app, the CLI and
+each job worker turn it on for themselves. Worker processes are sent the
+compressed bytes, which are smaller than decoded pixels and still allow
+reduced-scale JPEG decoding, so no pixels are shared between processes.
+
+Set ``COLLAGE_DECODE_POOL_MB`` to change the budget; 0 turns pooling off.
+"""
+import os
+
+from PIL import Image
+
+SESSION_CAP_BYTES = int(os.environ.get('COLLAGE_SESSION_CAP_MB', '512')) * 1024 * 1024
+DECODE_POOL_BYTES = int(os.environ.get('COLLAGE_DECODE_POOL_MB', '256')) * 1024 * 1024
+
+def pool_decode_buffers(max_bytes=DECODE_POOL_BYTES):
+    """Keep up to max_bytes of freed pixel blocks in this process for later decodes to reuse"""
+    Image.core.set_blocks_max(max_bytes // Image.core.get_block_size())
+
+def decode_pool_stats():
+    """Block counts of this process's pixel allocations since it started, and the idle bytes kept"""
+    stats = Image.core.get_stats()
+    return {
+        'allocated_blocks': stats['allocated_blocks'],
+        'reused_blocks': stats['reused_blocks'],
+        'idle_bytes': stats['blocks_cached'] * Image.core.get_block_size(),
+        'max_idle_bytes': Image.core.get_blocks_max() * Image.core.get_block_size(),
+    }
+
+def record_bytes(record):
+    """Memory a session spends on one ImageRecord"""
+    return len(record.data) + len(record.thumbnail)
+
+def session_usage(records, *blobs):
+    """Total bytes held by a session: its records plus any other stored bytes"""
+    # Records of duplicate uploads share one bytes object
+    unique = {record.digest: record for record in records}
+    return sum(record_bytes(record) for record in unique.values()) + sum(len(blob) for blob in blobs if blob)
@@ -0,0 +1,264 @@
+"""Lightweight per-stage instrumentation for the collage pipeline
+
+Stages are timed with ``with stage('resize', bytes_in=n) as s: ...``.
+While metrics are disabled (the default) ``stage`` returns a shared no-op
+context, so instrumented code pays one global lookup and a call.
+
+When enabled, every stage:
+
+* adds to process-wide totals, exposed in the Prometheus text format by
+  ``render_prometheus``, ``write_prometheus`` and ``serve_prometheus``;
+* is logged as one JSON line on the ``collage.metrics`` logger;
+* is appended to the current ``run``, if any, for a per-request breakdown.
+
+Runs made in worker processes are brought back with ``adopt_run``, which
+adds their stages to this process's totals and log.
+
+Set ``COLLAGE_METRICS=1`` to enable at import time, and
+``COLLAGE_METRICS_FILE`` to rewrite a Prometheus text file after each run.
+"""
+import contextvars
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+logger = logging.getLogger('collage.metrics')
+
+_enabled = os.environ.get('COLLAGE_METRICS', '') not in ('', '0')
+_metrics_file = os.environ.get('COLLAGE_METRICS_FILE')
+_current_run = contextvars.ContextVar('collage_metrics_run', default=None)
+_lock = threading.Lock()
+_totals = defaultdict(lambda: {'calls': 0, 'seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0})
+_run_ids = itertools.count(1)
+
+def enable(flag=True):
+    """Turn instrumentation on or off for the whole process"""
+    global _enabled
+    _enabled = flag
+
+def is_enabled():
+    return _enabled
+
+def set_metrics_file(path):
+    """Rewrite the Prometheus text file at path after each run, or never if None"""
+    global _metrics_file
+    _metrics_file = path
+
+def pixel_bytes(image):
+    """Decoded size of an image, from its header"""
+    return image.width * image.height * len(image.getbands())
+
+def peak_rss_bytes():
+    """High-water mark of the process's resident set size over its lifetime, or 0 if unknown"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+def current_rss_bytes():
+    """Resident set size right now, or 0 where /proc is not available"""
+    try:
+        with open('/proc/self/statm', 'rb') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return 0
+
+class _NoopStage:
+    """Stand-in returned while metrics are disabled"""
+    bytes_out = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NOOP = _NoopStage()
+
+class _Stage:
+    __slots__ = ('name', 'bytes_in', 'bytes_out', 'start', 'rss_start')
+
+    def __init__(self, name, bytes_in):
+        self.name = name
+        self.bytes_in = bytes_in
+        self.bytes_out = 0
+
+    def __enter__(self):
+        self.rss_start = current_rss_bytes()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.start
+        rss = current_rss_bytes()
+        record = {
+            'stage': self.name,
+            'seconds': seconds,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            # Sampled when the stage ends, while its output is still alive
+            'rss_bytes': rss,
+            'rss_growth_bytes': rss - self.rss_start,
+            'ok': exc_type is None,
+            'thread': threading.current_thread().name,
+        }
+        add_to_totals(record)
+
+        current = _current_run.get()
+        if current is not None:
+            current.add(record)
+            record['run'] = current.run_id
+        logger.info(json.dumps(record))
+        return False
+
+def add_to_totals(record):
+    """Count one stage record in the process-wide totals"""
+    with _lock:
+        totals = _totals[record['stage']]
+        totals['calls'] += 1
+        totals['seconds'] += record['seconds']
+        totals['bytes_in'] += record['bytes_in']
+        totals['bytes_out'] += record['bytes_out']
+
+def stage(name, bytes_in=0):
+    """Context manager timing one pipeline stage; set .bytes_out before leaving"""
+    if not _enabled:
+        return _NOOP
+    return _Stage(name, bytes_in)
+
+class Run:
+    """Stage records for one request, e.g. one collage"""
+
+    def __init__(self, label):
+        self.run_id = f"{label}-{next(_run_ids)}"
+        self.label = label
+        self.records = []
+        # Resident set size when the run started; the process high-water mark can't show a single run's peak
+        self.rss_start = 0
+        self._lock = threading.Lock()
+        self._token = None
+
+    def add(self, record):
+        # Records adopted from a worker keep the growth measured in the worker's run
+        if record['rss_bytes'] and 'run_rss_growth_bytes' not in record:
+            record['run_rss_growth_bytes'] = record['rss_bytes'] - self.rss_start
+        with self._lock:
+            self.records.append(record)
+
+    def breakdown(self):
+        """Per-stage totals: calls, seconds, bytes in/out and this run's peak RSS growth
+
+        peak_rss_growth_bytes is the most the resident set had grown since the
+        run started, sampled as each call of the stage ended.
+        """
+        summary = {}
+        with self._lock:
+            for record in self.records:
+                entry = summary.setdefault(record['stage'], {
+                    'calls': 0, 'seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0, 'peak_rss_growth_bytes': 0
+                })
+                entry['calls'] += 1
+                entry['seconds'] += record['seconds']
+                entry['bytes_in'] += record['bytes_in']
+                entry['bytes_out'] += record['bytes_out']
+                entry['peak_rss_growth_bytes'] = max(
+                    entry['peak_rss_growth_bytes'], record.get('run_rss_growth_bytes', 0)
+                )
+        return summary
+
+    def __enter__(self):
+        self.rss_start = current_rss_bytes()
+        self._token = _current_run.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current_run.reset(self._token)
+        if _enabled and _metrics_file:
+            write_prometheus(_metrics_file)
+        return False
+
+def run(label):
+    """Collect the stages of one request: ``with run('collage') as r: ...``"""
+    return Run(label)
+
+def export_run(current):
+    """Picklable form of a finished run, for adopt_run in another process"""
+    return {'label': current.label, 'records': list(current.records)}
+
+def adopt_run(exported):
+    """A Run rebuilt from export_run, its stages added to this process's totals and log"""
+    adopted = Run(exported['label'])
+    # Stages added later, such as the download encode, measure growth in this process
+    adopted.rss_start = current_rss_bytes()
+    for record in exported['records']:
+        add_to_totals(record)
+        record['run'] = adopted.run_id
+        adopted.add(record)
+        logger.info(json.dumps(record))
+    if _enabled and _metrics_file:
+        write_prometheus(_metrics_file)
+    return adopted
+
+def submit_in_context(pool, function, *args):
+    """Submit to an executor so worker-thread stages land in the caller's run"""
+    return pool.submit(contextvars.copy_context().run, function, *args)
+
+def render_prometheus():
+    """Process-wide totals in the Prometheus text exposition format"""
+    with _lock:
+        snapshot = {name: dict(values) for name, values in _totals.items()}
+    lines = []
+    for metric, field, help_text in (
+        ('collage_stage_calls_total', 'calls', 'Completed pipeline stages'),
+        ('collage_stage_seconds_total', 'seconds', 'Wall time spent in pipeline stages'),
+        ('collage_stage_bytes_in_total', 'bytes_in', 'Bytes consumed by pipeline stages'),
+        ('collage_stage_bytes_out_total', 'bytes_out', 'Bytes produced by pipeline stages'),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name in sorted(snapshot):
+            lines.append(f'{metric}{{stage="{name}"}} {snapshot[name][field]}')
+    lines.append("# HELP collage_peak_rss_bytes High-water mark of the process's resident set size since it started")
+    lines.append("# TYPE collage_peak_rss_bytes gauge")
+    lines.append(f"collage_peak_rss_bytes {peak_rss_bytes()}")
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(path):
+    """Atomically rewrite a Prometheus text file, e.g. for node_exporter's textfile collector"""
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as output:
+        output.write(render_prometheus())
+    os.replace(temporary_path, path)
+
+def serve_prometheus(port, host='127.0.0.1'):
+    """Serve the metrics text on a daemon thread, returning the server"""
+    # Imported here to keep http.server off the CLI's import path
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='collage-metrics', daemon=True).start()
+    return server
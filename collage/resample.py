@@ -0,0 +1,36 @@
+"""Resampling quality tiers shared by every resize in the package
+
+* ``best``: a single LANCZOS pass from the full-resolution source;
+* ``balanced``: downscales of 2x or more are first shrunk by an integer
+  factor with Image.reduce (a box average, done in Pillow's reducing_gap
+  step), leaving a final LANCZOS pass from less than twice the output
+  size; upscales use BICUBIC;
+* ``fast``: BOX for downscales and BILINEAR for upscales.
+
+For downscales of less than 2x, balanced is identical to best.
+benchmarks/bench_resample.py measures the speed and PSNR of each tier.
+"""
+from PIL import Image
+
+QUALITY_TIERS = ('fast', 'balanced', 'best')
+DEFAULT_QUALITY = 'balanced'
+
+# Pillow reduces by int(source / output / gap), so a gap of 1 starts reducing at 2x and
+# leaves the final LANCZOS pass less than twice the output size
+REDUCING_GAP = 1.0
+
+def resample(image, size, box=None, quality=DEFAULT_QUALITY):
+    """Resize image, or the box region of it, to exactly size with the given quality tier"""
+    if quality not in QUALITY_TIERS:
+        raise ValueError(f"Unknown resampling quality: {quality}")
+    source_width = box[2] - box[0] if box else image.width
+    source_height = box[3] - box[1] if box else image.height
+    upscale = size[0] > source_width or size[1] > source_height
+
+    if quality == 'best':
+        return image.resize(size, Image.Resampling.LANCZOS, box=box)
+    if quality == 'fast':
+        return image.resize(size, Image.Resampling.BILINEAR if upscale else Image.Resampling.BOX, box=box)
+    if upscale:
+        return image.resize(size, Image.Resampling.BICUBIC, box=box)
+    return image.resize(size, Image.Resampling.LANCZOS, box=box, reducing_gap=REDUCING_GAP)
@@ -0,0 +1,156 @@
+"""Process-wide, content-addressed store of ingested uploads
+
+Uploads are indexed by the hash of their bytes, so the same file uploaded
+twice, by one session or by many, is parsed once and shares one
+ImageRecord: one bytes object and one thumbnail. Its resized tiles are
+shared too, through the TileCache, which keys tiles by the same hash.
+
+Each session holds a StoreLease naming the uploads it uses. An entry
+referenced by any live lease is never evicted. Unreferenced entries are
+kept for later re-uploads and evicted least recently used first once the
+store exceeds its byte budget; their cached tiles are dropped with them.
+A lease releases its references when it is garbage collected, so sessions
+that end without cleaning up do not pin their uploads forever.
+
+Set ``COLLAGE_STORE_CAP_MB`` to change the budget.
+"""
+import os
+import threading
+import weakref
+from collections import OrderedDict
+
+from .memory import record_bytes
+
+STORE_CAP_BYTES = int(os.environ.get('COLLAGE_STORE_CAP_MB', '1024')) * 1024 * 1024
+
+class UploadStore:
+    """Thread-safe map of content hash to ImageRecord with refcounts and LRU eviction
+
+    It can be passed as ``known`` to collage.ingest.ingest_upload.
+    """
+
+    def __init__(self, max_bytes=STORE_CAP_BYTES, tile_cache=None):
+        self.max_bytes = max_bytes
+        self.tile_cache = tile_cache
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._records = OrderedDict()
+        self._refs = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, digest):
+        with self._lock:
+            return digest in self._records
+
+    def __len__(self):
+        with self._lock:
+            return len(self._records)
+
+    def get(self, digest, default=None):
+        """The stored record for digest, or default"""
+        with self._lock:
+            record = self._records.get(digest)
+            if record is None:
+                self.misses += 1
+                return default
+            self._records.move_to_end(digest)
+            self.hits += 1
+            return record
+
+    def setdefault(self, digest, record):
+        """Store record unless the digest is already known, returning the stored record"""
+        with self._lock:
+            if digest in self._records:
+                self._records.move_to_end(digest)
+                return self._records[digest]
+            self._records[digest] = record
+            self.current_bytes += record_bytes(record)
+            # The new record is about to be leased by its session, so older entries go first
+            evicted = self._evict(keep=digest)
+        self._drop_tiles(evicted)
+        return record
+
+    def lease(self):
+        """A new StoreLease for one session"""
+        return StoreLease(self)
+
+    def refcount(self, digest):
+        with self._lock:
+            return self._refs.get(digest, 0)
+
+    def stats(self):
+        """Entry, byte, hit, miss and eviction counters"""
+        with self._lock:
+            return {
+                'entries': len(self._records),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'referenced': len(self._refs),
+                'shared': sum(1 for count in self._refs.values() if count > 1),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _acquire(self, digests):
+        with self._lock:
+            for digest in digests:
+                self._refs[digest] = self._refs.get(digest, 0) + 1
+
+    def _release(self, digests):
+        with self._lock:
+            for digest in digests:
+                count = self._refs.get(digest, 0) - 1
+                if count > 0:
+                    self._refs[digest] = count
+                else:
+                    self._refs.pop(digest, None)
+            evicted = self._evict()
+        self._drop_tiles(evicted)
+
+    def _evict(self, keep=None):
+        """Drop unreferenced records, oldest first, until within budget; call with the lock held"""
+        evicted = []
+        if self.current_bytes <= self.max_bytes:
+            return evicted
+        for digest in [digest for digest in self._records if digest not in self._refs and digest != keep]:
+            self.current_bytes -= record_bytes(self._records.pop(digest))
+            self.evictions += 1
+            evicted.append(digest)
+            if self.current_bytes <= self.max_bytes:
+                break
+        return evicted
+
+    def _drop_tiles(self, digests):
+        if self.tile_cache is not None and digests:
+            self.tile_cache.discard(digests)
+
+class StoreLease:
+    """The set of store entries one session is using"""
+
+    def __init__(self, store):
+        self.store = store
+        # Shared with the finalizer, which must not refer to the lease itself
+        self._held = set()
+        self._finalizer = weakref.finalize(self, release_held, store, self._held)
+
+    def hold(self, digests):
+        """Reference exactly these digests, releasing the ones no longer used"""
+        digests = set(digests)
+        added = digests - self._held
+        removed = self._held - digests
+        self.store._acquire(added)
+        self._held.difference_update(removed)
+        self._held.update(added)
+        self.store._release(removed)
+
+    def release(self):
+        """Release every held digest; the lease can be reused afterwards"""
+        self.hold(())
+
+def release_held(store, held):
+    """Finalizer of a collected StoreLease"""
+    store._release(list(held))
+    held.clear()
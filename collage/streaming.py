@@ -0,0 +1,73 @@
+"""Tile-by-tile collage assembly and incremental PNG encoding"""
+import struct
+import zlib
+
+from PIL import Image
+
+from .core import calculate_grid_size, resize_image, scaled_size
+from .resample import DEFAULT_QUALITY
+from .sources import reopen_image
+
+def iter_collage_bands(images, scale_factor=0.45, cols_per_row=None, quality=DEFAULT_QUALITY):
+    """Yield the collage geometry, then one RGB band per grid row"""
+    num_images = len(images)
+    rows, cols = calculate_grid_size(num_images, cols_per_row)
+    
+    # Pass one: grid geometry from image headers, nothing is decoded
+    sizes = [scaled_size(img, scale_factor) for img in images]
+    max_width = max(width for width, height in sizes)
+    max_height = max(height for width, height in sizes)
+    yield cols * max_width, rows * max_height
+    
+    # Pass two: decode, resize and paste each tile, releasing it straight away
+    for row in range(rows):
+        band = Image.new('RGB', (cols * max_width, max_height), (255, 255, 255))
+        for col, img in enumerate(images[row * cols:(row + 1) * cols]):
+            tile = resize_image(reopen_image(img), scale_factor, flatten=False, quality=quality)
+            band.paste(tile, (col * max_width, 0), tile if tile.mode in ('RGBA', 'LA') else None)
+            del tile
+        yield band
+
+def write_png_chunk(output, chunk_type, data):
+    """Write one length-prefixed, CRC-terminated PNG chunk"""
+    output.write(struct.pack('>I', len(data)))
+    output.write(chunk_type)
+    output.write(data)
+    output.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+def write_png_bands(output, width, height, bands, compress_level=6):
+    """Encode RGB bands of the given width as one PNG, band by band"""
+    output.write(b'\x89PNG\r\n\x1a\n')
+    write_png_chunk(output, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+    
+    compressor = zlib.compressobj(compress_level)
+    stride = width * 3
+    for band in bands:
+        raw = band.tobytes()
+        # Every scanline is prefixed with filter type 0 (None)
+        scanlines = b''.join(b'\x00' + raw[i:i + stride] for i in range(0, len(raw), stride))
+        data = compressor.compress(scanlines)
+        if data:
+            write_png_chunk(output, b'IDAT', data)
+    write_png_chunk(output, b'IDAT', compressor.flush())
+    write_png_chunk(output, b'IEND', b'')
+
+def stream_collage(images, scale_factor=0.45, cols_per_row=None, output=None, quality=DEFAULT_QUALITY):
+    """Create a collage one tile at a time, optionally straight into a PNG file"""
+    if not images:
+        return None
+    
+    bands = iter_collage_bands(images, scale_factor, cols_per_row, quality)
+    collage_width, collage_height = next(bands)
+    
+    # Write row bands to the encoder so the canvas is never materialized
+    if output is not None:
+        write_png_bands(output, collage_width, collage_height, bands)
+        return None
+    
+    collage = Image.new('RGB', (collage_width, collage_height), (255, 255, 255))
+    y = 0
+    for band in bands:
+        collage.paste(band, (0, y))
+        y += band.height
+    return collage
@@ -0,0 +1,36 @@
+"""Tests for collage.archive
+
+Run from the repository root:
+
+    python -m pytest -q tests
+"""
+import io
+import zipfile
+
+import pytest
+
+from collage.archive import iter_zip_images
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+def test_members_within_limits_are_read():
+    archive = make_zip({'a.png': b'a' * 1000, 'notes.txt': b'x' * 5000, '__MACOSX/._a.png': b'', 'b.jpg': b'b'})
+    members = [(name, member.read()) for name, member in iter_zip_images(archive, 1000, 2000)]
+    assert members == [('a.png', b'a' * 1000), ('b.jpg', b'b')]
+
+def test_oversized_member_is_rejected_before_reading():
+    # Compresses to a few kilobytes
+    archive = make_zip({'small.png': b'a', 'bomb.png': b'\0' * 10_000_000})
+    with pytest.raises(ValueError, match="bomb.png"):
+        next(iter_zip_images(archive, max_member_bytes=1_000_000))
+
+def test_archive_total_is_capped():
+    archive = make_zip({f"{i}.png": b'\0' * 600_000 for i in range(4)})
+    with pytest.raises(ValueError, match="per archive"):
+        next(iter_zip_images(archive, max_member_bytes=1_000_000, max_archive_bytes=2_000_000))
@@ -0,0 +1,209 @@
+"""Concurrency tests for collage.jobs.JobQueue
+
+Run from the repository root:
+
+    python -m pytest -q tests
+"""
+import io
+import os
+import threading
+import time
+import zipfile
+from concurrent.futures import Future
+
+import pytest
+from PIL import Image
+
+from collage import TileCache, count_missing_tiles, metrics
+from collage.jobs import CANCELLED, DONE, FAILED, FINISHED, Job, JobQueue
+
+def encoded_files(count, size=(32, 32)):
+    files = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, (i * 40 % 256, 90, 160)).save(buffer, format='PNG')
+        files.append((f"{i}.png", buffer.getvalue()))
+    return files
+
+def wait_for(predicate, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.01)
+
+def drain(queue):
+    """Wait until the progress thread has consumed every queued message"""
+    wait_for(queue._progress.empty)
+    time.sleep(0.1)
+
+@pytest.fixture(scope='module')
+def queue():
+    job_queue = JobQueue(max_workers=2, max_jobs=1000)
+    yield job_queue
+    job_queue.shutdown()
+
+def test_batch_job_result(queue):
+    job_id = queue.submit('batch_resize', {'files': encoded_files(3), 'scale': 0.5})
+    wait_for(lambda: queue.get(job_id).status in FINISHED)
+    job = queue.get(job_id)
+    assert job.status == DONE
+    assert len(zipfile.ZipFile(io.BytesIO(job.result['zip'])).namelist()) == 3
+
+def test_collage_job_tiles_warm_the_callers_cache(queue):
+    files = encoded_files(4)
+    spec = {'images': [data for _, data in files], 'scale': 0.5, 'cols': 2, 'tile_budget': 1024 * 1024}
+    job_id = queue.submit('collage', spec)
+    wait_for(lambda: queue.get(job_id).status in FINISHED)
+    cache = TileCache()
+    for key, tile in queue.get(job_id).result['tiles']:
+        cache.put(key, tile)
+    images = [Image.open(io.BytesIO(data)) for _, data in files]
+    assert count_missing_tiles(images, 0.5) == 4
+    assert count_missing_tiles(images[::-1], 0.5, cache) == 0
+
+def test_job_metrics_come_back_to_the_caller(queue):
+    metrics.enable()
+    try:
+        job_id = queue.submit('collage', {'images': [data for _, data in encoded_files(4)], 'scale': 0.5})
+        wait_for(lambda: queue.get(job_id).status in FINISHED)
+    finally:
+        metrics.enable(False)
+    job = queue.get(job_id)
+    assert job.status == DONE and 'metrics' not in job.result
+    breakdown = job.run.breakdown()
+    assert breakdown['resize']['calls'] == 4
+    assert breakdown['collage']['calls'] == 1
+    assert 'collage_stage_calls_total{stage="resize"}' in metrics.render_prometheus()
+
+def test_same_key_reuses_job(queue):
+    spec = {'files': encoded_files(1), 'scale': 0.5}
+    assert queue.submit('batch_resize', spec, key='same') == queue.submit('batch_resize', spec, key='same')
+
+def test_late_progress_does_not_reopen_finished_job(queue):
+    job_id = queue.submit('batch_resize', {'files': encoded_files(2), 'scale': 0.5})
+    wait_for(lambda: queue.get(job_id).status in FINISHED)
+    for done in range(50):
+        queue._progress.put((job_id, done, 50))
+    drain(queue)
+    assert queue.get(job_id).status == DONE
+
+class InterleavedJob(Job):
+    """Job whose first status read by the progress thread lets _finish run before the read returns"""
+
+    def __init__(self, *args, finish):
+        self.finish = finish
+        super().__init__(*args)
+
+    @property
+    def status(self):
+        status = self._status
+        if self.finish is not None and threading.current_thread().name == 'collage-jobs':
+            finish, self.finish = self.finish, None
+            finisher = threading.Thread(target=finish)
+            finisher.start()
+            # Without the lock _finish completes here, after the caller has read the stale status
+            finisher.join(timeout=0.2)
+        return status
+
+    @status.setter
+    def status(self, value):
+        self._status = value
+
+def test_finish_during_progress_update(queue):
+    """A job finishing between the progress thread's check and write must stay finished"""
+    future = Future()
+    future.set_result({'zip': b'', 'errors': []})
+    job = InterleavedJob('interleaved', 'batch_resize', None, 0, finish=lambda: queue._finish(job, future))
+    with queue._lock:
+        queue._jobs[job.job_id] = job
+    queue._progress.put((job.job_id, 1, 1))
+    wait_for(lambda: job.finish is None)
+    # Past the interleaving window, by which time both threads are done with the job
+    time.sleep(0.5)
+    assert job.status == DONE
+
+def test_hammer_submit_and_finish(queue):
+    """Many jobs submitted from several threads, with stale progress arriving throughout"""
+    job_ids = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def submitter():
+        for _ in range(25):
+            job_id = queue.submit('batch_resize', {'files': encoded_files(3, (8, 8)), 'scale': 0.5})
+            with lock:
+                job_ids.append(job_id)
+
+    def spammer():
+        while not stop.is_set():
+            with lock:
+                snapshot = list(job_ids)
+            for job_id in snapshot:
+                queue._progress.put((job_id, 1, 3))
+            time.sleep(0.001)
+
+    spam = threading.Thread(target=spammer)
+    spam.start()
+    submitters = [threading.Thread(target=submitter) for _ in range(4)]
+    for thread in submitters:
+        thread.start()
+    for thread in submitters:
+        thread.join()
+    try:
+        wait_for(lambda: all(queue.get(job_id).status in FINISHED for job_id in job_ids))
+    finally:
+        stop.set()
+        spam.join()
+    drain(queue)
+
+    assert len(job_ids) == 100
+    assert {queue.get(job_id).status for job_id in job_ids} == {DONE}
+
+def test_cancel_queued_job(queue):
+    files = encoded_files(40, (1200, 1200))
+    slow = queue.submit('batch_resize', {'files': files, 'scale': 0.9})
+    others = [queue.submit('batch_resize', {'files': files, 'scale': 0.8}) for _ in range(3)]
+    for job_id in others:
+        assert queue.cancel(job_id)
+    wait_for(lambda: all(queue.get(job_id).status in FINISHED for job_id in others + [slow]))
+    assert {queue.get(job_id).status for job_id in others} == {CANCELLED}
+    assert queue.get(slow).status == DONE
+
+def test_dead_worker_fails_its_job_and_the_pool_recovers():
+    job_queue = JobQueue(max_workers=1)
+    try:
+        spec = {'files': encoded_files(40, (1200, 1200)), 'scale': 0.9}
+        doomed = job_queue.submit('batch_resize', spec, key='doomed')
+        wait_for(lambda: job_queue.get(doomed).status != 'queued')
+        # As if the OOM killer had stepped in
+        for process in list(job_queue._pool._processes.values()):
+            process.kill()
+        wait_for(lambda: job_queue.get(doomed).status in FINISHED)
+        assert job_queue.get(doomed).status == FAILED
+        assert job_queue.get(doomed).error
+
+        # The same key gets a new job on a fresh pool instead of the dead one
+        retry = job_queue.submit('batch_resize', {'files': encoded_files(2), 'scale': 0.5}, key='doomed')
+        assert retry != doomed
+        wait_for(lambda: job_queue.get(retry).status in FINISHED)
+        assert job_queue.get(retry).status == DONE
+    finally:
+        job_queue.shutdown()
+
+def test_failed_export_leaves_no_directory(tmp_path, monkeypatch):
+    # Spawned workers read the temporary directory from their environment
+    monkeypatch.setenv('TMPDIR', str(tmp_path))
+    job_queue = JobQueue(max_workers=1)
+    try:
+        images = [data for _, data in encoded_files(2)]
+        job_id = job_queue.submit('collage', {'images': images, 'scale': 0.5, 'export': 'tiff'})
+        wait_for(lambda: job_queue.get(job_id).status in FINISHED)
+        assert job_queue.get(job_id).status == FAILED
+        assert os.listdir(tmp_path) == []
+
+        job_id = job_queue.submit('collage', {'images': images, 'scale': 0.5, 'export': 'strips'})
+        wait_for(lambda: job_queue.get(job_id).status in FINISHED)
+        assert os.path.exists(job_queue.get(job_id).result['export']['path'])
+    finally:
+        job_queue.shutdown()
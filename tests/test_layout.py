@@ -0,0 +1,29 @@
+"""Tests for collage.layout
+
+Run from the repository root:
+
+    python -m pytest -q tests
+"""
+import random
+
+from PIL import Image
+
+from collage import create_collage
+from collage.layout import cell_layout
+
+def test_crop_boxes_stay_inside_their_images():
+    rng = random.Random(0)
+    for _ in range(2000):
+        sizes = [(rng.randint(1, 4000), rng.randint(1, 4000)) for _ in range(7)]
+        cell_size = (rng.randint(1, 600), rng.randint(1, 600))
+        layout = cell_layout(sizes, cell_size, mode='crop')
+        for (width, height), placement in zip(sizes, layout.placements):
+            left, top, right, bottom = placement.box
+            assert 0 <= left < right <= width
+            assert 0 <= top < bottom <= height
+
+def test_crop_collage_renders():
+    # A 200x150 image in a 69x51 cell used to get a box starting just left of the image
+    images = [Image.new('RGB', (200, 150), (i * 30, 90, 160)) for i in range(7)]
+    layout = cell_layout([image.size for image in images], (69, 51), mode='crop')
+    assert create_collage(images, layout=layout).size == (layout.width, layout.height)
@@ -0,0 +1,21 @@
+"""Tests for collage.memory
+
+Run from the repository root:
+
+    python -m pytest -q tests
+"""
+from PIL import Image
+
+from collage.memory import decode_pool_stats, pool_decode_buffers
+
+def test_pooled_blocks_are_reused():
+    pool_decode_buffers(64 * 1024 * 1024)
+    try:
+        Image.new('RGB', (3000, 2000)).convert('RGBA')
+        before = decode_pool_stats()
+        assert before['idle_bytes'] > 0
+        Image.new('RGB', (3000, 2000)).convert('RGBA')
+        assert decode_pool_stats()['reused_blocks'] > before['reused_blocks']
+    finally:
+        pool_decode_buffers(0)
+    assert decode_pool_stats()['idle_bytes'] == 0